@@ -0,0 +1,73 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from typing import Optional
+from app.env import API_BASE
+from app.cache import negative_cache, response_cache
+from app.disk_cache import disk_cache
+from app.search_index import search_index
+from app.profiling import folded_stacks, make_profile_token, profile_captures
+from app.utils import require_admin_token
+router = APIRouter(dependencies=[Depends(require_admin_token)])
+
+class CachePurgeRequest(BaseModel):
+    path: Optional[str] = None
+    family: Optional[str] = None
+
+@router.get("/admin/cache")
+async def get_cache_stats():
+    """Get response cache statistics."""
+    stats = response_cache.stats()
+    if disk_cache is not None:
+        stats["disk"] = await disk_cache.stats()
+    if negative_cache is not None:
+        stats["negative"] = negative_cache.stats()
+    if search_index is not None:
+        stats["search_index"] = search_index.stats()
+    return stats
+
+@router.post("/admin/cache/purge")
+async def purge_cache(request: Optional[CachePurgeRequest] = None):
+    """Purge cached VRChat responses."""
+    """'path' is an upstream path prefix such as '/users/usr_...', 'family' a cache policy name such as 'worlds'."""
+    """Without a body, the whole cache is purged, remembered 404/403 answers included."""
+    request = request or CachePurgeRequest()
+    prefix = f"{API_BASE}{request.path}" if request.path else None
+    purged = response_cache.purge(prefix=prefix, policy=request.family)
+    if disk_cache is not None:
+        purged += await disk_cache.purge(prefix=prefix, policy=request.family)
+    if negative_cache is not None and prefix is None and request.family is None:
+        purged += negative_cache.clear()
+    return {"purged": purged}
+
+
+@router.get("/admin/profiles")
+async def list_profiles():
+    """List the requests captured by this worker's profiler, newest first."""
+    """Requests slower than PROFILING_SLOW_THRESHOLD_MS are captured with their timing breakdown, stack-sampled ones with a profile."""
+    return {"captures": profile_captures.list()}
+
+@router.get("/admin/profiles/{capture_id}")
+async def get_profile(capture_id: str, format: str = Query(default="json", pattern="^(json|folded)$")):
+    """Download a captured request profile."""
+    """'format=folded' returns the stack samples as folded stacks, for flamegraph.pl or speedscope."""
+    capture = profile_captures.get(capture_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        return PlainTextResponse(
+            folded_stacks(capture), headers={"Content-Disposition": f'attachment; filename="profile-{capture_id}.folded"'}
+        )
+    return capture
+
+@router.delete("/admin/profiles")
+async def clear_profiles():
+    """Drop this worker's captured profiles."""
+    return {"cleared": profile_captures.clear()}
+
+@router.post("/admin/profiles/token")
+async def create_profile_token(ttl: int = Query(default=300, ge=1, le=3600)):
+    """Create a token for the X-Profile request header."""
+    """Requests carrying it are stack sampled and captured, even with PROFILING_ENABLED off, until it expires."""
+    token, expires = make_profile_token(ttl)
+    return {"header": "X-Profile", "token": token, "expires": expires}
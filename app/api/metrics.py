@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from app.metrics import registry
+from app.utils import require_metrics_token
+router = APIRouter(dependencies=[Depends(require_metrics_token)])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics for this worker: requests, latencies, upstream calls, rate limiting and caches."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
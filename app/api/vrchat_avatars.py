@@ -1,29 +1,46 @@
-from fastapi import APIRouter, HTTPException
-import httpx
-import json
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
 from app.env import CLIENT_NAME, API_BASE
 from app.vrchat_context import get_context_safely
+from app.upstream import PRIORITY_BULK
+from app.utils import (
+    validate_vrchat_avatar_id,
+    fetch_vrchat_json,
+    proxy_vrchat_json,
+    run_batch_lookup,
+    BatchLookupRequest
+)
 router = APIRouter()
 
-@router.get("/avatars/{avatar_id}")
-async def get_worlds(avatar_id: str):
-    """Get information about a specific avatars by its ID."""
+@router.post("/avatars/batch")
+async def get_avatars_batch(request: BatchLookupRequest):
+    """Get information about several avatars by their IDs in one call."""
+    """Returns per-ID results and per-ID errors."""
     vrchat = get_context_safely()
     if not vrchat.auth_cookie or not vrchat.auth_cookie.startswith("authcookie_"):
-        raise HTTPException(status_code=401, detail="Token not found, please authenticate first")
-
-    auth_cookie = vrchat.auth_cookie
-    if not auth_cookie:
-        raise HTTPException(status_code=401, detail="Auth cookie missing in token")
+        raise HTTPException(status_code=401, detail="Authentication required")
 
     headers = {"User-Agent": CLIENT_NAME}
-    cookies = {"auth": auth_cookie}
-    url = f"{API_BASE}/avatars/{avatar_id}"
+    cookies = {"auth": vrchat.auth_cookie}
 
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url, headers=headers, cookies=cookies)
+    async def fetch(avatar_id: str):
+        url = f"{API_BASE}/avatars/{avatar_id}"
+        return await fetch_vrchat_json(url, headers, cookies, "get avatar", policy="avatars", priority=PRIORITY_BULK)
+
+    return await run_batch_lookup(request.ids, validate_vrchat_avatar_id, fetch, request.fields)
+
+@router.get("/avatars/{avatar_id}")
+async def get_avatar(avatar_id: str, fields: Optional[str] = Query(default=None)):
+    """Get information about a specific avatar by its ID."""
+    # Validate input
+    avatar_id = validate_vrchat_avatar_id(avatar_id)
 
-    if r.status_code != 200:
-        raise HTTPException(status_code=r.status_code, detail=f"Failed to fetch avatars info: {r.text}")
+    vrchat = get_context_safely()
+    if not vrchat.auth_cookie or not vrchat.auth_cookie.startswith("authcookie_"):
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+    headers = {"User-Agent": CLIENT_NAME}
+    cookies = {"auth": vrchat.auth_cookie}
+    url = f"{API_BASE}/avatars/{avatar_id}"
 
-    return r.json()
\ No newline at end of file
+    return await proxy_vrchat_json(url, headers, cookies, "get avatar", policy="avatars", fields=fields)
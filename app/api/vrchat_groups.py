@@ -1,19 +1,44 @@
 from fastapi import APIRouter, HTTPException, Query
-import httpx
+from fastapi.responses import StreamingResponse
 import json
 from typing import Optional
 from app.env import CLIENT_NAME, API_BASE
 from app.vrchat_context import get_context_safely
+from app.upstream import PRIORITY_BULK
 from app.utils import (
     validate_vrchat_group_id,
     validate_pagination_params,
-    make_vrchat_request,
-    handle_vrchat_response
+    fetch_vrchat_json,
+    proxy_vrchat_json,
+    run_batch_lookup,
+    stream_vrchat_pages,
+    BatchLookupRequest
 )
 router = APIRouter()
 
+@router.post("/groups/batch")
+async def get_groups_batch(request: BatchLookupRequest):
+    """Get information about several groups by their IDs in one call."""
+    """Returns per-ID results and per-ID errors."""
+    vrchat = get_context_safely()
+    if not vrchat.auth_cookie or not vrchat.auth_cookie.startswith("authcookie_"):
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+    headers = {"User-Agent": CLIENT_NAME}
+    cookies = {"auth": vrchat.auth_cookie}
+    params = {
+        "includeRoles": "true",
+        "purpose": "group"
+    }
+
+    async def fetch(group_id: str):
+        url = f"{API_BASE}/groups/{group_id}"
+        return await fetch_vrchat_json(url, headers, cookies, "get group", params=params, policy="groups", priority=PRIORITY_BULK)
+
+    return await run_batch_lookup(request.ids, validate_vrchat_group_id, fetch, request.fields)
+
 @router.get("/groups/{group_id}")
-async def get_groups(group_id: str):
+async def get_groups(group_id: str, fields: Optional[str] = Query(default=None)):
     """Get information about a specific group by its ID."""
     # Validate input
     group_id = validate_vrchat_group_id(group_id)
@@ -28,19 +53,12 @@ async def get_groups(group_id: str):
         "includeRoles": "true",
         "purpose": "group"
     }
-    
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(f"{API_BASE}/groups/{group_id}", headers=headers, cookies=cookies, params=params)
-    except httpx.TimeoutException:
-        raise HTTPException(status_code=504, detail="VRChat API timeout")
-    except httpx.RequestError:
-        raise HTTPException(status_code=502, detail="VRChat API unavailable")
-        
-    return handle_vrchat_response(response, "get group")
+    url = f"{API_BASE}/groups/{group_id}"
+
+    return await proxy_vrchat_json(url, headers, cookies, "get group", params=params, policy="groups", fields=fields)
 
 @router.get("/groups/{group_id}/instances")
-async def get_groups_instances(group_id: str):
+async def get_groups_instances(group_id: str, fields: Optional[str] = Query(default=None)):
     """Get instances of a specific group by its ID."""
     # Validate input
     group_id = validate_vrchat_group_id(group_id)
@@ -53,11 +71,10 @@ async def get_groups_instances(group_id: str):
     cookies = {"auth": vrchat.auth_cookie}
     url = f"{API_BASE}/groups/{group_id}/instances"
 
-    response = await make_vrchat_request(url, headers, cookies)
-    return handle_vrchat_response(response, "get group instances")
+    return await proxy_vrchat_json(url, headers, cookies, "get group instances", policy="group_instances", fields=fields)
 
 @router.get("/groups/{group_id}/posts")
-async def get_groups_posts(group_id: str, n: int = Query(default=10), offset: int = Query(default=0)):
+async def get_groups_posts(group_id: str, n: int = Query(default=10), offset: int = Query(default=0), fields: Optional[str] = Query(default=None)):
     """Get posts of a specific group by its ID with pagination support."""
     # Validate inputs
     group_id = validate_vrchat_group_id(group_id)
@@ -74,20 +91,30 @@ async def get_groups_posts(group_id: str, n: int = Query(default=10), offset: in
         "offset": str(offset),  
         "publicOnly": False
     }
-    
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(f"{API_BASE}/groups/{group_id}/posts", headers=headers, cookies=cookies, params=params)
-    except httpx.TimeoutException:
-        raise HTTPException(status_code=504, detail="VRChat API timeout")
-    except httpx.RequestError:
-        raise HTTPException(status_code=502, detail="VRChat API unavailable")
-        
-    return handle_vrchat_response(response, "get group posts")
+    url = f"{API_BASE}/groups/{group_id}/posts"
+
+    return await proxy_vrchat_json(url, headers, cookies, "get group posts", params=params, fields=fields)
+
+
+@router.get("/groups/{group_id}/posts/all")
+async def get_groups_posts_all(group_id: str):
+    """Stream every post of a specific group as NDJSON, one post per line."""
+    group_id = validate_vrchat_group_id(group_id)
+
+    vrchat = get_context_safely()
+    if not vrchat.auth_cookie or not vrchat.auth_cookie.startswith("authcookie_"):
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+    headers = {"User-Agent": CLIENT_NAME}
+    cookies = {"auth": vrchat.auth_cookie}
+    params = {"publicOnly": False}
+    url = f"{API_BASE}/groups/{group_id}/posts"
 
+    lines = await stream_vrchat_pages(url, headers, cookies, "get group posts", params=params, items_key="posts")
+    return StreamingResponse(lines, media_type="application/x-ndjson")
 
 @router.get("/groups/{group_id}/bans")
-async def get_groups_bans(group_id: str, n: int = Query(default=51), offset: int = Query(default=0)):
+async def get_groups_bans(group_id: str, n: int = Query(default=51), offset: int = Query(default=0), fields: Optional[str] = Query(default=None)):
     """Get bans of a specific group by its ID with pagination support."""
     # Validate inputs
     group_id = validate_vrchat_group_id(group_id)
@@ -103,19 +130,28 @@ async def get_groups_bans(group_id: str, n: int = Query(default=51), offset: int
         "n": str(n),
         "offset": str(offset),
     }
-    
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(f"{API_BASE}/groups/{group_id}/bans", headers=headers, cookies=cookies, params=params)
-    except httpx.TimeoutException:
-        raise HTTPException(status_code=504, detail="VRChat API timeout")
-    except httpx.RequestError:
-        raise HTTPException(status_code=502, detail="VRChat API unavailable")
-        
-    return handle_vrchat_response(response, "get group bans")
+    url = f"{API_BASE}/groups/{group_id}/bans"
+
+    return await proxy_vrchat_json(url, headers, cookies, "get group bans", params=params, fields=fields)
+
+@router.get("/groups/{group_id}/bans/all")
+async def get_groups_bans_all(group_id: str):
+    """Stream every ban of a specific group as NDJSON, one ban per line."""
+    group_id = validate_vrchat_group_id(group_id)
+
+    vrchat = get_context_safely()
+    if not vrchat.auth_cookie or not vrchat.auth_cookie.startswith("authcookie_"):
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+    headers = {"User-Agent": CLIENT_NAME}
+    cookies = {"auth": vrchat.auth_cookie}
+    url = f"{API_BASE}/groups/{group_id}/bans"
+
+    lines = await stream_vrchat_pages(url, headers, cookies, "get group bans")
+    return StreamingResponse(lines, media_type="application/x-ndjson")
 
 @router.get("/groups/{group_id}/roles")
-async def get_groups_roles(group_id: str):
+async def get_groups_roles(group_id: str, fields: Optional[str] = Query(default=None)):
     """Get roles of a specific group by its ID."""
     """This endpoint requires the group ID to be passed as a query parameter."""
     """The group ID is used to fetch the roles related to the group."""
@@ -131,16 +167,10 @@ async def get_groups_roles(group_id: str):
     cookies = {"auth": auth_cookie}
     url = f"{API_BASE}/groups/{group_id}/roles"
 
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url, headers=headers, cookies=cookies)
-
-    if r.status_code != 200:
-        raise HTTPException(status_code=r.status_code, detail=f"Failed to fetch groups roles info: {r.text}")
-
-    return r.json()
+    return await proxy_vrchat_json(url, headers, cookies, "get group roles", fields=fields)
 
 @router.get("/groups/{group_id}/members")
-async def get_groups_members(group_id: str, n: int = Query(default=12), offset: int = Query(default=0)):
+async def get_groups_members(group_id: str, n: int = Query(default=12), offset: int = Query(default=0), fields: Optional[str] = Query(default=None)):
     """Get members of a specific group by its ID."""
     """This endpoint requires the group ID to be passed as a query parameter."""
     """The group ID is used to fetch the members related to the group."""
@@ -164,13 +194,24 @@ async def get_groups_members(group_id: str, n: int = Query(default=12), offset:
     }
     url = f"{API_BASE}/groups/{group_id}/members"
 
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url, headers=headers, cookies=cookies, params=params)
+    return await proxy_vrchat_json(url, headers, cookies, "get group members", params=params, fields=fields)
 
-    if r.status_code != 200:
-        raise HTTPException(status_code=r.status_code, detail=f"Failed to fetch groups members info: {r.text}")
+@router.get("/groups/{group_id}/members/all")
+async def get_groups_members_all(group_id: str):
+    """Stream every member of a specific group as NDJSON, one member per line."""
+    """Pages are fetched from VRChat internally, so memory use does not grow with the group size."""
+    group_id = validate_vrchat_group_id(group_id)
 
-    return r.json()
+    vrchat = get_context_safely()
+    if not vrchat.auth_cookie or not vrchat.auth_cookie.startswith("authcookie_"):
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+    headers = {"User-Agent": CLIENT_NAME}
+    cookies = {"auth": vrchat.auth_cookie}
+    url = f"{API_BASE}/groups/{group_id}/members"
+
+    lines = await stream_vrchat_pages(url, headers, cookies, "get group members")
+    return StreamingResponse(lines, media_type="application/x-ndjson")
 
 @router.get("/groups/me")
 async def get_bot_groups_profile():
@@ -191,10 +232,4 @@ async def get_bot_groups_profile():
     cookies = {"auth": auth_cookie}
     url = f"{API_BASE}/groups/me"
 
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url, headers=headers, cookies=cookies)
-
-    if r.status_code != 200:
-        raise HTTPException(status_code=r.status_code, detail=f"Failed to fetch bot groups profile info: {r.text}")
-
-    return r.json()
\ No newline at end of file
+    return await proxy_vrchat_json(url, headers, cookies, "get bot groups profile")
\ No newline at end of file
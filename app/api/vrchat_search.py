@@ -1,39 +1,42 @@
 from fastapi import APIRouter, HTTPException, Query
-import httpx
-import json
 from typing import Optional
 from app.env import CLIENT_NAME, API_BASE
 from app.vrchat_context import get_context_safely
+from app.search_index import search_index
+from app.utils import proxy_vrchat_json, validate_pagination_params, ORJSONResponse
 router = APIRouter()
 
 @router.get("/auth/exists/{type}/{text}")
 async def get_if_exists_per_type(type: str, text: str):
     """Check if a user or world exists by username or email."""
+    """Answers are cached briefly, and identical concurrent checks share one VRChat call."""
     if type not in ["username", "email"]:
         raise HTTPException(status_code=400, detail="Invalid type, must be 'username' or 'email'")
     
+    text = text.strip()
     if not text:
         raise HTTPException(status_code=400, detail="Text cannot be empty")
 
     headers = {"User-Agent": CLIENT_NAME}
-    url = f"{API_BASE}/auth/exists?{type}={text}{'&displayName=' + text if type == 'username' else ''}"
+    params = {type: text}
+    if type == "username":
+        params["displayName"] = text
+    url = f"{API_BASE}/auth/exists"
 
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url, headers=headers)
-
-    if r.status_code != 200:
-        raise HTTPException(status_code=r.status_code, detail=f"Failed to fetch if {type} exists: {r.text}")
-
-    return r.json()
+    return await proxy_vrchat_json(url, headers, None, f"check if {type} exists", params=params, policy="auth_exists")
 
 @router.get("/search/{type}/{search_text}")
 async def search_by_type(type: str, search_text: str, n: int = Query(default=12)):
     """Search for users or worlds by type and search text."""
+    """Type-ahead queries are answered from users and worlds already seen when enough of them match (X-Cache: LOCAL);"""
+    """otherwise VRChat's results are cached briefly."""
     if type not in ["users", "worlds"]:
         raise HTTPException(status_code=400, detail="Invalid type, must be 'users' or 'worlds'")
     
+    search_text = search_text.strip()
     if not search_text:
         raise HTTPException(status_code=400, detail="Search text cannot be empty")
+    _, n = validate_pagination_params(None, n)
     
     vrchat = get_context_safely()
     if not vrchat.auth_cookie or not vrchat.auth_cookie.startswith("authcookie_"):
@@ -43,6 +46,11 @@ async def search_by_type(type: str, search_text: str, n: int = Query(default=12)
     if not auth_cookie:
         raise HTTPException(status_code=401, detail="Auth cookie missing in token")
 
+    if search_index is not None:
+        local_results = search_index.search(type, search_text, n)
+        if local_results is not None:
+            return ORJSONResponse(local_results, headers={"X-Cache": "LOCAL"})
+
     headers = {"User-Agent": CLIENT_NAME}
     cookies = {"auth": auth_cookie}
     params = {
@@ -53,10 +61,4 @@ async def search_by_type(type: str, search_text: str, n: int = Query(default=12)
     }   
     url = f"{API_BASE}/{type}"
 
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url, headers=headers, cookies=cookies, params=params)
-
-    if r.status_code != 200:
-        raise HTTPException(status_code=r.status_code, detail=f"Failed to search {type} by: {r.text}")
-
-    return r.json()
\ No newline at end of file
+    return await proxy_vrchat_json(url, headers, cookies, f"search {type}", params=params, policy="search", index=type)
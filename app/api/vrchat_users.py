@@ -1,19 +1,21 @@
 from fastapi import APIRouter, HTTPException, Query
-import httpx
 import json
 from typing import Optional
 from app.env import CLIENT_NAME, API_BASE
 from app.vrchat_context import get_context_safely
+from app.upstream import PRIORITY_BULK
 from app.utils import (
     validate_vrchat_user_id,
     validate_pagination_params,
-    make_vrchat_request,
-    handle_vrchat_response
+    fetch_vrchat_json,
+    proxy_vrchat_json,
+    run_batch_lookup,
+    BatchLookupRequest
 )
 router = APIRouter()
 
 @router.get("/users/me")
-async def get_bot_users_profile():
+async def get_bot_users_profile(fields: Optional[str] = Query(default=None)):
     """Get the current bot's user profile."""
     vrchat = get_context_safely()
     if not vrchat.auth_cookie or not vrchat.auth_cookie.startswith("authcookie_"):
@@ -23,11 +25,27 @@ async def get_bot_users_profile():
     cookies = {"auth": vrchat.auth_cookie}
     url = f"{API_BASE}/users/{vrchat.user_id}"
 
-    response = await make_vrchat_request(url, headers, cookies)
-    return handle_vrchat_response(response, "get bot profile")
+    return await proxy_vrchat_json(url, headers, cookies, "get bot profile", fields=fields)
+
+@router.post("/users/batch")
+async def get_users_batch(request: BatchLookupRequest):
+    """Get several users' profiles by user ID in one call."""
+    """Returns per-ID results and per-ID errors."""
+    vrchat = get_context_safely()
+    if not vrchat.auth_cookie or not vrchat.auth_cookie.startswith("authcookie_"):
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+    headers = {"User-Agent": CLIENT_NAME}
+    cookies = {"auth": vrchat.auth_cookie}
+
+    async def fetch(user_id: str):
+        url = f"{API_BASE}/users/{user_id}"
+        return await fetch_vrchat_json(url, headers, cookies, "get user", policy="users", index="users", priority=PRIORITY_BULK)
+
+    return await run_batch_lookup(request.ids, validate_vrchat_user_id, fetch, request.fields)
 
 @router.get("/users/{user_id}")
-async def get_user(user_id: str):
+async def get_user(user_id: str, fields: Optional[str] = Query(default=None)):
     """Get a user's profile by user ID."""
     # Validate input
     user_id = validate_vrchat_user_id(user_id)
@@ -40,11 +58,10 @@ async def get_user(user_id: str):
     cookies = {"auth": vrchat.auth_cookie}
     url = f"{API_BASE}/users/{user_id}"
 
-    response = await make_vrchat_request(url, headers, cookies)
-    return handle_vrchat_response(response, "get user")
+    return await proxy_vrchat_json(url, headers, cookies, "get user", policy="users", index="users", fields=fields)
 
 @router.get("/users/{user_id}/friends/status")
-async def get_user_friend_status(user_id: str):
+async def get_user_friend_status(user_id: str, fields: Optional[str] = Query(default=None)):
     """Get the friend status of a user by user ID."""
     # Validate input
     user_id = validate_vrchat_user_id(user_id)
@@ -57,11 +74,10 @@ async def get_user_friend_status(user_id: str):
     cookies = {"auth": vrchat.auth_cookie}
     url = f"{API_BASE}/users/{user_id}/friendStatus"
 
-    response = await make_vrchat_request(url, headers, cookies)
-    return handle_vrchat_response(response, "get friend status")
+    return await proxy_vrchat_json(url, headers, cookies, "get friend status", fields=fields)
 
 @router.get("/users/{user_id}/groups")
-async def get_user_groups(user_id: str):
+async def get_user_groups(user_id: str, fields: Optional[str] = Query(default=None)):
     """Get the groups a user belongs to by user ID."""
     # Validate input
     user_id = validate_vrchat_user_id(user_id)
@@ -74,11 +90,10 @@ async def get_user_groups(user_id: str):
     cookies = {"auth": vrchat.auth_cookie}
     url = f"{API_BASE}/users/{user_id}/groups"
 
-    response = await make_vrchat_request(url, headers, cookies)
-    return handle_vrchat_response(response, "get user groups")
+    return await proxy_vrchat_json(url, headers, cookies, "get user groups", policy="users", fields=fields)
 
 @router.get("/users/{user_id}/worlds")
-async def get_user_worlds(user_id: str, n: int = Query(default=100), offset: int = Query(default=0)):
+async def get_user_worlds(user_id: str, n: int = Query(default=100), offset: int = Query(default=0), fields: Optional[str] = Query(default=None)):
     """Get the worlds created by a user by user ID."""
     # Validate inputs
     user_id = validate_vrchat_user_id(user_id)
@@ -98,14 +113,6 @@ async def get_user_worlds(user_id: str, n: int = Query(default=100), offset: int
         "n": str(n),
         "offset": str(offset)
     }
-    
-    # Use httpx client with params
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(f"{API_BASE}/worlds", headers=headers, cookies=cookies, params=params)
-    except httpx.TimeoutException:
-        raise HTTPException(status_code=504, detail="VRChat API timeout")
-    except httpx.RequestError:
-        raise HTTPException(status_code=502, detail="VRChat API unavailable")
-        
-    return handle_vrchat_response(response, "get user worlds")
\ No newline at end of file
+    url = f"{API_BASE}/worlds"
+
+    return await proxy_vrchat_json(url, headers, cookies, "get user worlds", params=params, policy="worlds", index="worlds", fields=fields)
\ No newline at end of file
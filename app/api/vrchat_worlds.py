@@ -1,18 +1,38 @@
-from fastapi import APIRouter, HTTPException
-import httpx
+from fastapi import APIRouter, HTTPException, Query
 import json
+from typing import Optional
 from app.env import CLIENT_NAME, API_BASE
 from app.vrchat_context import get_context_safely
+from app.upstream import PRIORITY_BULK
 from app.utils import (
     validate_vrchat_world_id,
     validate_vrchat_instance_id,
-    make_vrchat_request,
-    handle_vrchat_response
+    fetch_vrchat_json,
+    proxy_vrchat_json,
+    run_batch_lookup,
+    BatchLookupRequest
 )
 router = APIRouter()
 
+@router.post("/worlds/batch")
+async def get_worlds_batch(request: BatchLookupRequest):
+    """Get information about several worlds by their IDs in one call."""
+    """Returns per-ID results and per-ID errors."""
+    vrchat = get_context_safely()
+    if not vrchat.auth_cookie or not vrchat.auth_cookie.startswith("authcookie_"):
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+    headers = {"User-Agent": CLIENT_NAME}
+    cookies = {"auth": vrchat.auth_cookie}
+
+    async def fetch(world_id: str):
+        url = f"{API_BASE}/worlds/{world_id}"
+        return await fetch_vrchat_json(url, headers, cookies, "get world", policy="worlds", index="worlds", priority=PRIORITY_BULK)
+
+    return await run_batch_lookup(request.ids, validate_vrchat_world_id, fetch, request.fields)
+
 @router.get("/worlds/{world_id}")
-async def get_worlds(world_id: str):
+async def get_worlds(world_id: str, fields: Optional[str] = Query(default=None)):
     """Get information about a specific world by its ID."""
     # Validate input
     world_id = validate_vrchat_world_id(world_id)
@@ -25,11 +45,10 @@ async def get_worlds(world_id: str):
     cookies = {"auth": vrchat.auth_cookie}
     url = f"{API_BASE}/worlds/{world_id}"
 
-    response = await make_vrchat_request(url, headers, cookies)
-    return handle_vrchat_response(response, "get world")
+    return await proxy_vrchat_json(url, headers, cookies, "get world", policy="worlds", index="worlds", fields=fields)
 
 @router.get("/worlds/{world_id}/metadata")
-async def get_worlds_metadata(world_id: str):
+async def get_worlds_metadata(world_id: str, fields: Optional[str] = Query(default=None)):
     """Get metadata about a specific world by its ID."""
     # Validate input
     world_id = validate_vrchat_world_id(world_id)
@@ -42,11 +61,10 @@ async def get_worlds_metadata(world_id: str):
     cookies = {"auth": vrchat.auth_cookie}
     url = f"{API_BASE}/worlds/{world_id}/metadata"
 
-    response = await make_vrchat_request(url, headers, cookies)
-    return handle_vrchat_response(response, "get world metadata")
+    return await proxy_vrchat_json(url, headers, cookies, "get world metadata", policy="world_metadata", fields=fields)
 
 @router.get("/worlds/{world_id}/{instance_id}")
-async def get_specific_instance_by_world(world_id: str, instance_id: str):
+async def get_specific_instance_by_world(world_id: str, instance_id: str, fields: Optional[str] = Query(default=None)):
     """Get information about a specific world instance by its ID."""
     # Validate inputs
     world_id = validate_vrchat_world_id(world_id)
@@ -60,5 +78,4 @@ async def get_specific_instance_by_world(world_id: str, instance_id: str):
     cookies = {"auth": vrchat.auth_cookie}
     url = f"{API_BASE}/worlds/{world_id}/{instance_id}"
 
-    response = await make_vrchat_request(url, headers, cookies)
-    return handle_vrchat_response(response, "get world instance")
\ No newline at end of file
+    return await proxy_vrchat_json(url, headers, cookies, "get world instance", policy="world_instances", fields=fields)
\ No newline at end of file
@@ -0,0 +1,322 @@
+"""
+In-process TTL response cache for proxied VRChat entities
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlencode
+import orjson
+from app.compression import compress
+from app.env import (
+    CACHE_MAX_ENTRIES,
+    CACHE_MAX_BYTES,
+    CACHE_TTL_USERS,
+    CACHE_TTL_WORLDS,
+    CACHE_TTL_WORLD_METADATA,
+    CACHE_TTL_WORLD_INSTANCES,
+    CACHE_TTL_GROUPS,
+    CACHE_TTL_GROUP_INSTANCES,
+    CACHE_TTL_AVATARS,
+    CACHE_TTL_SEARCH,
+    CACHE_TTL_AUTH_EXISTS,
+    CACHE_STALE_WHILE_REVALIDATE,
+    CACHE_STALE_IF_ERROR,
+    CACHE_REVALIDATE_WINDOW,
+    CACHE_NEGATIVE_TTL,
+    CACHE_NEGATIVE_MAX_ENTRIES
+)
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """
+    Caching rules for one family of routes. Past its TTL an entry may still be served
+    for stale_while_revalidate seconds while it is refreshed in the background, and
+    for stale_if_error seconds when refreshing it fails.
+    """
+    name: str
+    ttl: float
+    stale_while_revalidate: float = 0
+    stale_if_error: float = 0
+
+    @property
+    def lifetime(self) -> float:
+        """Seconds from fetch until an entry can no longer be served at all"""
+        return self.ttl + max(self.stale_while_revalidate, self.stale_if_error)
+
+CACHE_POLICIES: Dict[str, CachePolicy] = {
+    policy.name: policy for policy in (
+        CachePolicy("users", CACHE_TTL_USERS, CACHE_STALE_WHILE_REVALIDATE, CACHE_STALE_IF_ERROR),
+        CachePolicy("worlds", CACHE_TTL_WORLDS, CACHE_STALE_WHILE_REVALIDATE, CACHE_STALE_IF_ERROR),
+        CachePolicy("world_metadata", CACHE_TTL_WORLD_METADATA),
+        CachePolicy("world_instances", CACHE_TTL_WORLD_INSTANCES),
+        CachePolicy("groups", CACHE_TTL_GROUPS),
+        CachePolicy("group_instances", CACHE_TTL_GROUP_INSTANCES),
+        CachePolicy("avatars", CACHE_TTL_AVATARS, CACHE_STALE_WHILE_REVALIDATE, CACHE_STALE_IF_ERROR),
+        CachePolicy("search", CACHE_TTL_SEARCH),
+        CachePolicy("auth_exists", CACHE_TTL_AUTH_EXISTS),
+    )
+}
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag derived from the response body"""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """ETag of the body in a content encoding: strong validators must differ between codings (RFC 9110 8.8.3)"""
+    return f'{etag[:-1]}-{encoding}"' if etag.endswith('"') else etag
+
+def upstream_validators(headers) -> Dict[str, str]:
+    """Conditional request headers to revalidate a response with VRChat, from its ETag/Last-Modified"""
+    validators = {}
+    if headers.get("ETag"):
+        validators["If-None-Match"] = headers["ETag"]
+    if headers.get("Last-Modified"):
+        validators["If-Modified-Since"] = headers["Last-Modified"]
+    return validators
+
+_UNPARSED = object()
+
+@dataclass
+class CacheEntry:
+    """
+    An upstream JSON body, kept as the raw bytes VRChat sent so it can be forwarded as is.
+    It is only parsed when something needs the object (batch results, projections).
+    """
+    body: bytes
+    policy: str
+    expires_at: float
+    stale_until: float
+    error_until: float
+    keep_until: float
+    # Our ETag for the body, and VRChat's own validators for conditional refreshes
+    etag: str = ""
+    validators: Optional[Dict[str, str]] = None
+    # Compressed forms of the body, by content encoding
+    compressed: Dict[str, bytes] = field(default_factory=dict, repr=False)
+    _data: Any = field(default=_UNPARSED, repr=False)
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(body) for body in self.compressed.values())
+
+    @property
+    def data(self) -> Any:
+        if self._data is _UNPARSED:
+            self._data = orjson.loads(self.body)
+        return self._data
+
+class ResponseCache:
+    """
+    LRU cache with per-entry TTL, bounded by entry count and total body size
+    """
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+
+    @staticmethod
+    def make_key(url: str, params: Optional[dict] = None) -> str:
+        """Build a cache key from the upstream URL and its query parameters"""
+        if not params:
+            return url
+        return f"{url}?{urlencode(sorted((k, str(v)) for k, v in params.items()))}"
+
+    def get(self, key: str, now: Optional[float] = None) -> Tuple[Optional[CacheEntry], str]:
+        """
+        Look up an entry and return it with its status:
+        HIT when fresh, STALE when it may be served while being revalidated, MISS otherwise.
+        A MISS may still return an expired entry, to revalidate conditionally or to fall back on if upstream fails.
+        """
+        now = now if now is not None else time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry.keep_until <= now:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None, "MISS"
+        self._entries.move_to_end(key)
+        status = self.classify(entry, now)
+        if status == "HIT":
+            self.hits += 1
+        elif status == "STALE":
+            self.stale_hits += 1
+        else:
+            self.misses += 1
+        return entry, status
+
+    @staticmethod
+    def classify(entry: CacheEntry, now: Optional[float] = None) -> str:
+        """HIT, STALE or MISS depending on the entry's age"""
+        now = now if now is not None else time.monotonic()
+        if now < entry.expires_at:
+            return "HIT"
+        if now < entry.stale_until:
+            return "STALE"
+        return "MISS"
+
+    def set(self, key: str, body: bytes, policy: CachePolicy, now: Optional[float] = None, etag: str = "", validators: Optional[Dict[str, str]] = None) -> CacheEntry:
+        """
+        Store an upstream body, evicting least recently used entries to stay within bounds.
+        'now' is when it was fetched, in the past for entries restored from disk.
+        The entry is returned even when it is too large to be kept.
+        """
+        entry = CacheEntry(
+            body=body,
+            policy=policy.name,
+            expires_at=0,
+            stale_until=0,
+            error_until=0,
+            keep_until=0,
+            etag=etag or make_etag(body),
+            validators=validators
+        )
+        self._extend(entry, policy, now)
+        return self._store(key, entry)
+
+    def refresh(self, key: str, entry: CacheEntry, policy: CachePolicy, now: Optional[float] = None) -> CacheEntry:
+        """
+        Extend an entry VRChat confirmed unchanged (a 304) in place,
+        so its compressed variants and parsed object are kept.
+        """
+        self._extend(entry, policy, now)
+        if self._entries.get(key) is entry:
+            self._entries.move_to_end(key)
+            return entry
+        return self._store(key, entry)
+
+    async def compressed(self, key: str, entry: CacheEntry, encoding: str) -> bytes:
+        """
+        Return the body in the given content encoding, compressing it only the first time.
+        That is done in a worker thread: at COMPRESSION_LEVEL_CACHED it can take tens of milliseconds.
+        """
+        body = entry.compressed.get(encoding)
+        if body is None:
+            body = await asyncio.to_thread(compress, entry.body, encoding)
+            if encoding in entry.compressed:
+                # Another request compressed it meanwhile
+                return entry.compressed[encoding]
+            entry.compressed[encoding] = body
+            if self._entries.get(key) is entry:
+                self.current_bytes += len(body)
+                # Variants count towards max_bytes like bodies do (this entry, just used, goes last)
+                self._entries.move_to_end(key)
+                self._evict()
+        return body
+
+    def discard(self, key: str):
+        if key in self._entries:
+            self._remove(key)
+
+    def purge(self, prefix: Optional[str] = None, policy: Optional[str] = None) -> int:
+        """Drop entries matching a key prefix and/or policy name; everything if neither is given"""
+        keys = [
+            key for key, entry in self._entries.items()
+            if (prefix is None or key.startswith(prefix)) and (policy is None or entry.policy == policy)
+        ]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0
+        }
+
+    @staticmethod
+    def _extend(entry: CacheEntry, policy: CachePolicy, now: Optional[float] = None):
+        """Restart an entry's lifetime as if it had been fetched at 'now'"""
+        now = now if now is not None else time.monotonic()
+        entry.policy = policy.name
+        entry.expires_at = now + policy.ttl
+        entry.stale_until = entry.expires_at + policy.stale_while_revalidate
+        entry.error_until = entry.expires_at + policy.stale_if_error
+        entry.keep_until = now + policy.lifetime + (CACHE_REVALIDATE_WINDOW if entry.validators else 0)
+
+    def _store(self, key: str, entry: CacheEntry) -> CacheEntry:
+        if entry.size > self.max_bytes:
+            return entry
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self.current_bytes += entry.size
+        self._evict()
+        return entry
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is within bounds"""
+        while self._entries and (len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry.size
+
+class NegativeCache:
+    """
+    Upstream 404/403 answers, remembered for a short TTL so repeated lookups of deleted or
+    nonexistent resources never leave the process. Like a Bloom filter, only a 64-bit
+    fingerprint of each key is kept (collisions are negligible at this size); unlike one,
+    entries expire and the oldest are evicted past max_entries.
+    """
+    def __init__(self, ttl: float, max_entries: int = 100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        # fingerprint -> (status code, expiry); insertion order is expiry order since the TTL is fixed
+        self._entries: "OrderedDict[int, Tuple[int, float]]" = OrderedDict()
+
+    @staticmethod
+    def fingerprint(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+    def get(self, key: str, now: Optional[float] = None) -> Optional[int]:
+        """Return the remembered status code for a key, or None"""
+        now = now if now is not None else time.monotonic()
+        fingerprint = self.fingerprint(key)
+        found = self._entries.get(fingerprint)
+        if found is None:
+            return None
+        status_code, expires_at = found
+        if expires_at <= now:
+            del self._entries[fingerprint]
+            return None
+        self.hits += 1
+        return status_code
+
+    def add(self, key: str, status_code: int, now: Optional[float] = None):
+        now = now if now is not None else time.monotonic()
+        fingerprint = self.fingerprint(key)
+        self._entries.pop(fingerprint, None)
+        self._entries[fingerprint] = (status_code, now + self.ttl)
+        while self._entries:
+            _, (_, expires_at) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def clear(self) -> int:
+        count = len(self._entries)
+        self._entries.clear()
+        return count
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "ttl": self.ttl, "hits": self.hits}
+
+response_cache = ResponseCache(max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES)
+negative_cache: Optional[NegativeCache] = NegativeCache(CACHE_NEGATIVE_TTL, CACHE_NEGATIVE_MAX_ENTRIES) if CACHE_NEGATIVE_TTL > 0 else None
@@ -0,0 +1,90 @@
+"""
+Response compression: Accept-Encoding negotiation and gzip / brotli / zstd encoders.
+gzip is always available; brotli and zstandard are in requirements.txt, and an install
+without them just does not offer their encodings.
+"""
+import zlib
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+from app.env import COMPRESSION_LEVEL_CACHED
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Encoding negotiated for the current request, set by CompressionMiddleware so handlers
+# serving cached bodies can answer with their precompressed form
+accepted_encoding: ContextVar[Optional[str]] = ContextVar("accepted_encoding", default=None)
+
+# Our preference when the client accepts several encodings equally
+PREFERENCE = [name for name, available in (("zstd", zstandard), ("br", brotli), ("gzip", True)) if available]
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/javascript", "text/")
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick the best supported encoding from an Accept-Encoding header, or None for identity"""
+    if not accept_encoding:
+        return None
+    qualities: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qualities[name.strip()] = q
+    wildcard = qualities.get("*", 0.0)
+    best, best_q = None, 0.0
+    for name in PREFERENCE:
+        q = qualities.get(name, wildcard)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+def is_compressible(content_type: str) -> bool:
+    return content_type.lower().startswith(COMPRESSIBLE_TYPES)
+
+def compress(body: bytes, encoding: str, level: int = COMPRESSION_LEVEL_CACHED) -> bytes:
+    """One-shot compression, used for complete bodies. 'level' runs from 1 (fast) to 9 (small)."""
+    if encoding == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+    if encoding == "br":
+        return brotli.compress(body, quality=min(11, level + 1))
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+class StreamCompressor:
+    """Incremental compressor for streaming responses; every chunk is flushed so lines reach the client promptly"""
+    def __init__(self, encoding: str, level: int):
+        self._finish: Callable[[], bytes]
+        if encoding == "gzip":
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self._chunk = lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = compressor.flush
+        elif encoding == "br":
+            compressor = brotli.Compressor(quality=min(11, level + 1))
+            self._chunk = lambda data: compressor.process(data) + compressor.flush()
+            self._finish = compressor.finish
+        elif encoding == "zstd":
+            compressor = zstandard.ZstdCompressor(level=level).compressobj()
+            self._chunk = lambda data: compressor.compress(data) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+            self._finish = compressor.flush
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._chunk(data) if data else b""
+
+    def finish(self) -> bytes:
+        return self._finish()
@@ -0,0 +1,160 @@
+"""
+Optional SQLite tier behind the in-process response cache, so a restarted bridge starts warm
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Set, Tuple
+from app.env import CACHE_DISK_ENABLED, CACHE_DISK_PATH
+
+logger = logging.getLogger(__name__)
+
+# Expired rows are swept at startup and then every this many writes
+PRUNE_EVERY = 1000
+
+class DiskCache:
+    """
+    Stores upstream JSON bodies with the wall-clock time they were fetched and the time
+    they stop being usable. Every call runs on a worker thread; the connection is shared
+    between threads and serialized with a lock. WAL mode lets several workers share the file.
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: Set["asyncio.Task"] = set()
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, policy TEXT NOT NULL, body BLOB NOT NULL, "
+            "stored_at REAL NOT NULL, keep_until REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_keep_until ON responses (keep_until)")
+        self._conn = conn
+        self._prune()
+
+    def _prune(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE keep_until <= ?", (time.time(),))
+
+    def _get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, stored_at FROM responses WHERE key = ? AND keep_until > ?", (key, time.time())
+            ).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def _set(self, key: str, policy: str, body: bytes, stored_at: float, keep_until: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, policy, body, stored_at, keep_until) VALUES (?, ?, ?, ?, ?)",
+                (key, policy, body, stored_at, keep_until)
+            )
+            self.writes += 1
+        if self.writes % PRUNE_EVERY == 0:
+            self._prune()
+
+    def _touch(self, key: str, stored_at: float, keep_until: float):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE responses SET stored_at = ?, keep_until = ? WHERE key = ?", (stored_at, keep_until, key)
+            )
+
+    def _discard(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def _purge(self, prefix: Optional[str], policy: Optional[str]) -> int:
+        clauses, args = [], []
+        if prefix is not None:
+            clauses.append("substr(key, 1, ?) = ?")
+            args += [len(prefix), prefix]
+        if policy is not None:
+            clauses.append("policy = ?")
+            args.append(policy)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            return self._conn.execute(f"DELETE FROM responses{where}", args).rowcount
+
+    def _count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    async def open(self):
+        await asyncio.to_thread(self._open)
+
+    async def close(self):
+        """Finish pending writes and close the database"""
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await asyncio.to_thread(conn.close)
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """Return (body, stored_at) for a still usable entry, or None"""
+        if self._conn is None:
+            return None
+        try:
+            stored = await asyncio.to_thread(self._get, key)
+        except sqlite3.Error as e:
+            logger.warning(f"Disk cache read failed: {e}")
+            return None
+        if stored is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return stored
+
+    def set(self, key: str, policy: str, body: bytes, keep_for: float):
+        """Write an entry in the background; the caller never waits for the disk"""
+        stored_at = time.time()
+        self._in_background(self._set, key, policy, body, stored_at, stored_at + keep_for)
+
+    def touch(self, key: str, keep_for: float):
+        """Mark an entry as fetched now, after VRChat confirmed it is unchanged"""
+        stored_at = time.time()
+        self._in_background(self._touch, key, stored_at, stored_at + keep_for)
+
+    def discard(self, key: str):
+        """Delete an entry in the background"""
+        self._in_background(self._discard, key)
+
+    def _in_background(self, fn, *args):
+        if self._conn is None:
+            return
+        task = asyncio.ensure_future(asyncio.to_thread(fn, *args))
+        self._pending.add(task)
+        task.add_done_callback(self._written)
+
+    def _written(self, task: "asyncio.Task"):
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Disk cache write failed: {task.exception()}")
+
+    async def purge(self, prefix: Optional[str] = None, policy: Optional[str] = None) -> int:
+        if self._conn is None:
+            return 0
+        return await asyncio.to_thread(self._purge, prefix, policy)
+
+    async def stats(self) -> dict:
+        return {
+            "path": str(self.path),
+            "entries": await asyncio.to_thread(self._count) if self._conn is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes
+        }
+
+disk_cache: Optional[DiskCache] = DiskCache(Path(CACHE_DISK_PATH)) if CACHE_DISK_ENABLED else None
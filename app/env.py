@@ -10,9 +10,106 @@ API_BASE = os.getenv("VRCHAT_API_BASE", "https://api.vrchat.cloud/api/1")
 TOKEN_FILE = Path(os.getenv("TOKEN_FILE", "data/auth/account.json"))
 IS_DISTANT = os.getenv("IS_DISTANT", "false").lower() in ("1", "true", "yes")
 DISTANT_URL_CONTEXT = os.getenv("DISTANT_URL_CONTEXT", "")
+CONTEXT_WATCH_INTERVAL = float(os.getenv("CONTEXT_WATCH_INTERVAL", "2"))
+DISTANT_CONTEXT_TTL = float(os.getenv("DISTANT_CONTEXT_TTL", "300"))
 PORT = os.environ.get("PORT", "8080")
 API_IS_PUBLIC = os.environ.get("API_IS_PUBLIC", "true").lower() in ("1", "true", "yes")
 
+# Upstream (VRChat API) connection pool configuration
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "true").lower() in ("1", "true", "yes")
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", "5"))
+# live, record (save upstream exchanges to UPSTREAM_RECORDING_PATH) or replay (serve them without network)
+UPSTREAM_MODE = os.getenv("UPSTREAM_MODE", "live").lower()
+UPSTREAM_RECORDING_PATH = os.getenv("UPSTREAM_RECORDING_PATH", "data/recordings/upstream.sqlite3")
+# Replayed latency as a multiple of the recorded one (0 answers immediately)
+UPSTREAM_REPLAY_TIMING = float(os.getenv("UPSTREAM_REPLAY_TIMING", "1"))
+# Open a connection to VRChat at startup, before the first request needs one
+UPSTREAM_WARMUP = os.getenv("UPSTREAM_WARMUP", "true").lower() in ("1", "true", "yes")
+UPSTREAM_COALESCE = os.getenv("UPSTREAM_COALESCE", "true").lower() in ("1", "true", "yes")
+
+# Outbound rate limit towards VRChat (requests per second, 0 disables it) and how long a call may wait for its turn
+UPSTREAM_RATE_LIMIT = float(os.getenv("UPSTREAM_RATE_LIMIT", "5"))
+UPSTREAM_RATE_BURST = int(os.getenv("UPSTREAM_RATE_BURST", "10"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "15"))
+UPSTREAM_RETRY_AFTER_DEFAULT = float(os.getenv("UPSTREAM_RETRY_AFTER_DEFAULT", "5"))
+# Number of worker processes sharing the limits above, set by run.py in production mode
+SERVER_WORKER_COUNT = max(1, int(os.getenv("SERVER_WORKER_COUNT", "1")))
+
+# Rate limiter storage: "memory" (per process), "redis" (shared by every instance) or "file" (shared by workers on one host)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+# Maximum number of client IPs tracked by the in-memory backend (least recently seen are evicted)
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "100000"))
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+# Max seconds a request waits on Redis (connecting included) before the limiter fails open
+RATE_LIMIT_REDIS_TIMEOUT = float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT", "0.5"))
+RATE_LIMIT_FILE = os.getenv("RATE_LIMIT_FILE", "data/ratelimit/counters.bin")
+RATE_LIMIT_FILE_SLOTS = int(os.getenv("RATE_LIMIT_FILE_SLOTS", "131072"))
+
+# Response cache configuration (TTLs in seconds, 0 disables caching for a family)
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL_USERS = float(os.getenv("CACHE_TTL_USERS", "60"))
+CACHE_TTL_WORLDS = float(os.getenv("CACHE_TTL_WORLDS", "300"))
+CACHE_TTL_WORLD_METADATA = float(os.getenv("CACHE_TTL_WORLD_METADATA", "3600"))
+CACHE_TTL_WORLD_INSTANCES = float(os.getenv("CACHE_TTL_WORLD_INSTANCES", "15"))
+CACHE_TTL_GROUPS = float(os.getenv("CACHE_TTL_GROUPS", "120"))
+CACHE_TTL_GROUP_INSTANCES = float(os.getenv("CACHE_TTL_GROUP_INSTANCES", "10"))
+CACHE_TTL_AVATARS = float(os.getenv("CACHE_TTL_AVATARS", "21600"))
+CACHE_TTL_SEARCH = float(os.getenv("CACHE_TTL_SEARCH", "30"))
+CACHE_TTL_AUTH_EXISTS = float(os.getenv("CACHE_TTL_AUTH_EXISTS", "10"))
+# Users, worlds and avatars only: serve expired entries while refreshing them in the background,
+# and keep serving the last good copy for a grace window when VRChat fails
+CACHE_STALE_WHILE_REVALIDATE = float(os.getenv("CACHE_STALE_WHILE_REVALIDATE", "60"))
+CACHE_STALE_IF_ERROR = float(os.getenv("CACHE_STALE_IF_ERROR", "900"))
+# Upstream 404/403 answers are remembered this long (0 disables it), for at most this many keys
+CACHE_NEGATIVE_TTL = float(os.getenv("CACHE_NEGATIVE_TTL", "60"))
+CACHE_NEGATIVE_MAX_ENTRIES = int(os.getenv("CACHE_NEGATIVE_MAX_ENTRIES", "100000"))
+# Expired entries with VRChat validators (ETag/Last-Modified) are kept this long to refresh them with a conditional request
+CACHE_REVALIDATE_WINDOW = float(os.getenv("CACHE_REVALIDATE_WINDOW", "300"))
+# Response compression (gzip, plus brotli/zstd when installed); levels from 1 (fast) to 9 (small)
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "5"))
+# Cached bodies are compressed once, so they can afford a stronger level
+COMPRESSION_LEVEL_CACHED = int(os.getenv("COMPRESSION_LEVEL_CACHED", "9"))
+# Local index of users and worlds seen in responses, answering type-ahead searches without VRChat
+SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+SEARCH_INDEX_MAX_ENTRIES = int(os.getenv("SEARCH_INDEX_MAX_ENTRIES", "50000"))
+# How long an indexed entity may be used, in seconds; 0 follows the users/worlds cache TTL plus the SWR window
+SEARCH_INDEX_MAX_AGE = float(os.getenv("SEARCH_INDEX_MAX_AGE", "0"))
+# Optional SQLite copy of cached responses, reloaded lazily after a restart
+CACHE_DISK_ENABLED = os.getenv("CACHE_DISK_ENABLED", "false").lower() in ("1", "true", "yes")
+CACHE_DISK_PATH = os.getenv("CACHE_DISK_PATH", "data/cache/responses.sqlite3")
+
+# Batch lookup endpoints
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", "200"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "10"))
+
+# Page size used when auto-paginating upstream lists (VRChat caps it at 100)
+PAGINATION_PAGE_SIZE = int(os.getenv("PAGINATION_PAGE_SIZE", "100"))
+
+# Token required by admin endpoints (cache purge, ...). Admin endpoints are disabled when empty.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Prometheus metrics on /api/metrics, served only to scrapers sending METRICS_TOKEN as a bearer token
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Request profiling: Server-Timing headers and capture of requests slower than the threshold,
+# plus stack sampling for a share of them. Requests carrying a valid X-Profile token are
+# profiled even when PROFILING_ENABLED is off.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_SLOW_THRESHOLD_MS = float(os.getenv("PROFILING_SLOW_THRESHOLD_MS", "1000"))
+PROFILING_MAX_CAPTURES = int(os.getenv("PROFILING_MAX_CAPTURES", "50"))
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+
 # CORS configuration
 CORS_ALLOWED_ORIGINS_ENV = os.environ.get("CORS_ALLOWED_ORIGINS", "unstealable.cloud")
 
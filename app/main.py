@@ -1,6 +1,8 @@
+import asyncio
 import os
 import sys
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -13,11 +15,59 @@ from app.api.vrchat_search import router as search
 from app.api.vrchat_users import router as users
 from app.api.vrchat_groups import router as groups
 from app.api.vrchat_worlds import router as worlds
+from app.api.vrchat_avatars import router as avatars
 from app.api.system import router as system
-from app.vrchat_context import get_context_safely
+from app.api.admin import router as admin
+from app.api.metrics import router as metrics
+from app.vrchat_context import VRChatContext, get_context_safely, refresh_context_forever
 from app.api.webhook_auth import router as webhook_auth
-from app.env import PORT, API_IS_PUBLIC, CORS_ALLOWED_ORIGINS, API_DOMAIN, is_subdomain_allowed
-from app.middleware import SecurityHeadersMiddleware, RateLimitMiddleware
+from app.env import API_BASE, ADMIN_TOKEN, CLIENT_NAME, UPSTREAM_MODE, UPSTREAM_WARMUP, METRICS_ENABLED, PROFILING_ENABLED, COMPRESSION_ENABLED, COMPRESSION_MIN_SIZE, COMPRESSION_LEVEL, PORT, API_IS_PUBLIC, CORS_ALLOWED_ORIGINS, API_DOMAIN, is_subdomain_allowed
+from app.utils import ORJSONResponse
+from app.middleware import CompressionMiddleware, ETagMiddleware, HandlerTimingMiddleware, MetricsMiddleware, ProfilingMiddleware, SecurityHeadersMiddleware, RateLimitMiddleware
+from app.rate_limit import create_rate_limit_backend
+from app.upstream import start_upstream_client, close_upstream_client, warm_upstream_client
+from app.disk_cache import disk_cache
+
+
+@asynccontextmanager
+async def context_lifespan(app: FastAPI):
+    """
+    Load the VRChat context and keep it refreshed while the application runs.
+    Requests only ever read it from memory (see get_context_safely).
+    """
+    if not VRChatContext.is_loaded():
+        try:
+            await VRChatContext.refresh()
+        except Exception as e:
+            print(f"[WARN] Could not load VRChat context at startup: {e}", flush=True)
+    context_refresher = asyncio.create_task(refresh_context_forever())
+    try:
+        yield
+    finally:
+        context_refresher.cancel()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Own the shared upstream client and the context refresher for the lifetime of the application.
+    Uvicorn only hands a worker connections once this startup has finished.
+    """
+    async with context_lifespan(app):
+        await start_upstream_client()
+        if UPSTREAM_WARMUP and UPSTREAM_MODE != "replay":
+            await warm_upstream_client(API_BASE, {"User-Agent": CLIENT_NAME})
+        if disk_cache is not None:
+            try:
+                await disk_cache.open()
+            except Exception as e:
+                print(f"[WARN] Could not open disk cache, continuing without it: {e}", flush=True)
+        try:
+            yield
+        finally:
+            await close_upstream_client()
+            if disk_cache is not None:
+                await disk_cache.close()
 
 
 def create_main_app():
@@ -33,7 +83,10 @@ This project is designed for developers who want a hassle-free way to integrate
 Features:
 - Automatic token management with 2FA handling
 - Public and private VRChat data endpoints
-- Response caching for performance
+- Response caching for performance (per route family TTLs, `X-Cache` header: HIT, MISS, STALE or STALE-IF-ERROR)
+- Upstream JSON forwarded byte for byte, other responses encoded with orjson
+- Response compression (gzip, brotli, zstd), cached bodies compressed once
+- Conditional requests: `ETag` on every GET response, `If-None-Match` answered with 304
 - Easy deployment on self-hosted servers
 
 Built with FastAPI and async HTTPX for high performance and reliability.
@@ -45,7 +98,9 @@ Built with FastAPI and async HTTPX for high performance and reliability.
         oauth2_redirect_url=None,
         init_oauth=None,
         openapi_url="/docs/api.json",
-        contact={"name": "unstealable", "url": "https://vrchat.com/home/user/usr_3e354294-5925-42bb-a5e6-511c39a390eb"}
+        contact={"name": "unstealable", "url": "https://vrchat.com/home/user/usr_3e354294-5925-42bb-a5e6-511c39a390eb"},
+        default_response_class=ORJSONResponse,
+        lifespan=lifespan
     )
 
     prefix = "/api"
@@ -55,6 +110,7 @@ Built with FastAPI and async HTTPX for high performance and reliability.
             app.include_router(users, prefix=prefix, tags=["Users"])
             app.include_router(groups, prefix=prefix, tags=["Groups"])
             app.include_router(worlds, prefix=prefix, tags=["Worlds"])
+            app.include_router(avatars, prefix=prefix, tags=["Avatars"])
             app.include_router(search, prefix=prefix, tags=["Search"])
         else:
             print("[WARN] No valid VRChat token found. Only public/system endpoints will be available.", flush=True)
@@ -62,12 +118,16 @@ Built with FastAPI and async HTTPX for high performance and reliability.
         print(f"[ERROR] Failed to load VRChat context: {e}", flush=True)
         print("[WARN] Only public/system endpoints will be available.", flush=True)
     app.include_router(system, prefix=prefix, tags=["System"])
+    app.include_router(admin, prefix=prefix, tags=["Admin"])
+    if METRICS_ENABLED:
+        app.include_router(metrics, prefix=prefix, tags=["System"])
 
     @app.exception_handler(HTTPException)
     async def http_exception_handler(request: Request, exc: HTTPException):
         return JSONResponse(
             status_code=exc.status_code,
-            content={"error": exc.detail, "code": exc.status_code}
+            content={"error": exc.detail, "code": exc.status_code},
+            headers=exc.headers
         )
 
     @app.exception_handler(RequestValidationError)
@@ -84,16 +144,45 @@ Built with FastAPI and async HTTPX for high performance and reliability.
             content={"error": "Internal server error"}
         )
 
-    # Add security and rate limiting middleware
+    # Add conditional request, compression, security, rate limiting, metrics and profiling middleware
+    # Profiling is possible whenever admins can hand out X-Profile tokens
+    profiling = PROFILING_ENABLED or bool(ADMIN_TOKEN)
+    if profiling:
+        app.add_middleware(HandlerTimingMiddleware)
+    app.add_middleware(ETagMiddleware)
+    if COMPRESSION_ENABLED:
+        app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE, level=COMPRESSION_LEVEL)
     app.add_middleware(SecurityHeadersMiddleware)
-    app.add_middleware(RateLimitMiddleware, calls_per_minute=60, calls_per_hour=1000)
+    app.add_middleware(RateLimitMiddleware, calls_per_minute=60, calls_per_hour=1000, backend=create_rate_limit_backend())
+    if METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware)
+    if profiling:
+        app.add_middleware(ProfilingMiddleware)
 
     return app
 
 
+async def prepare_workers():
+    """
+    Pre-fork warm-up, run once by run.py before starting production workers:
+    fail fast on a broken configuration and set up shared files (disk cache schema
+    and sweep, shared rate limit file) once instead of racing in every worker
+    """
+    await VRChatContext.refresh()
+    if VRChatContext.is_loaded():
+        print("[INFO] VRChat context loaded", flush=True)
+    else:
+        print("[WARN] No VRChat context yet, workers will only serve public/system endpoints", flush=True)
+    if disk_cache is not None:
+        await disk_cache.open()
+        await disk_cache.close()
+    create_rate_limit_backend()
+
+
 def create_auth_webhook_app():
     from fastapi import FastAPI
-    app = FastAPI(title="VRChat Bridge Auth Webhook")
+    # The token file appears once the login goes through; the refresher picks it up
+    app = FastAPI(title="VRChat Bridge Auth Webhook", lifespan=context_lifespan)
     app.include_router(webhook_auth, prefix="/webhook/auth", tags=["Auth Webhook"])
     app.include_router(system, prefix="/api", tags=["System"])
     return app
@@ -101,6 +190,9 @@ def create_auth_webhook_app():
 if __name__ == "__main__":
     if "--auth-mode" in sys.argv:
         uvicorn.run(create_auth_webhook_app(), host="0.0.0.0", port=PORT, reload=False)
+    elif "--prepare" in sys.argv:
+        asyncio.run(prepare_workers())
+        sys.exit(0)
     else:
         uvicorn.run(create_main_app(), host="0.0.0.0", port=PORT, reload=True)
 
@@ -132,6 +224,6 @@ app.add_middleware(
     allow_origins=allow_origins,
     allow_credentials=allow_credentials,
     allow_methods=["GET", "POST", "OPTIONS"],  # Restrict to needed methods only
-    allow_headers=["Content-Type", "Authorization", "User-Agent"],  # Specific headers only
-    expose_headers=["Content-Type"]  # Limit exposed headers
+    allow_headers=["Content-Type", "Authorization", "User-Agent", "If-None-Match"],  # Specific headers only
+    expose_headers=["Content-Type", "X-Cache", "ETag"]  # Limit exposed headers
 )
\ No newline at end of file
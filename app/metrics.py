@@ -0,0 +1,227 @@
+"""
+Prometheus metrics in the text exposition format, without external dependencies.
+Updating a metric is a dict lookup and an addition (plus a bisect for histograms),
+cheap enough to stay on under full load. Values are per process: with several
+workers, each scrape reads the worker that happens to answer it.
+"""
+import hmac
+import re
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from app.cache import negative_cache, response_cache
+from app.env import METRICS_TOKEN
+from app.disk_cache import disk_cache
+from app.search_index import search_index
+from app.upstream import outbound_limiter, pool_stats, upstream_flights
+
+# Seconds; the bridge answers from cache in well under a millisecond and waits on VRChat for tens to hundreds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Exposition lines of every series, without the HELP/TYPE header"""
+
+class Counter(Metric):
+    """
+    A value updated by the code, or read from 'collect' at scrape time for
+    statistics other modules already keep (cache hits, limiter queue...)
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), collect: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._collect = collect
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> List[str]:
+        values = self._collect() if self._collect is not None else self._values
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) - amount
+
+    def set(self, value: float, *label_values: str):
+        self._values[label_values] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # label values -> [count per bucket (last one is +Inf), sum]
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self._values.get(label_values)
+        if series is None:
+            series = self._values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = series
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        bounds = [*self.buckets, float("inf")]
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels((*self.labels, 'le'), (*key, _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            samples = metric.samples()
+            if samples:
+                lines += metric.header() + samples
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "vrchat_bridge_http_requests_total", "HTTP requests handled, by route template and status", ("method", "route", "status")
+))
+http_request_duration = registry.register(Histogram(
+    "vrchat_bridge_http_request_duration_seconds", "Time to answer HTTP requests, by route template", ("method", "route")
+))
+http_requests_in_flight = registry.register(Gauge(
+    "vrchat_bridge_http_requests_in_flight", "HTTP requests being handled"
+))
+rate_limit_rejections = registry.register(Counter(
+    "vrchat_bridge_rate_limit_rejections_total", "Requests rejected by the per-client rate limiter, by window", ("window",)
+))
+upstream_requests = registry.register(Counter(
+    "vrchat_bridge_upstream_requests_total", "Calls to the VRChat API, by endpoint and status", ("endpoint", "status")
+))
+upstream_request_duration = registry.register(Histogram(
+    "vrchat_bridge_upstream_request_duration_seconds", "VRChat API response time, by endpoint", ("endpoint",)
+))
+upstream_requests_in_flight = registry.register(Gauge(
+    "vrchat_bridge_upstream_requests_in_flight", "Calls to the VRChat API awaiting an answer"
+))
+upstream_queue_timeouts = registry.register(Counter(
+    "vrchat_bridge_upstream_queue_timeouts_total", "Calls dropped after waiting too long for the outbound rate limiter"
+))
+process_start_time = registry.register(Gauge(
+    "vrchat_bridge_process_start_time_seconds", "Start time of this worker since the Unix epoch"
+))
+process_start_time.set(time.time())
+http_requests_in_flight.set(0)
+upstream_requests_in_flight.set(0)
+
+def _cache_lookups() -> Dict[LabelValues, float]:
+    lookups = {
+        ("memory", "hit"): response_cache.hits,
+        ("memory", "stale"): response_cache.stale_hits,
+        ("memory", "miss"): response_cache.misses
+    }
+    if negative_cache is not None:
+        lookups[("negative", "hit")] = negative_cache.hits
+    if disk_cache is not None:
+        lookups[("disk", "hit")] = disk_cache.hits
+        lookups[("disk", "miss")] = disk_cache.misses
+    if search_index is not None:
+        lookups[("search_index", "hit")] = search_index.local_answers
+    return lookups
+
+def _cache_hit_ratio() -> Dict[LabelValues, float]:
+    return {(): response_cache.stats()["hit_ratio"]}
+
+registry.register(Counter(
+    "vrchat_bridge_cache_lookups_total", "Cache lookups, by tier and result", ("tier", "result"), collect=_cache_lookups
+))
+registry.register(Gauge(
+    "vrchat_bridge_cache_hit_ratio", "Share of memory cache lookups served from cache (fresh or stale)", collect=_cache_hit_ratio
+))
+registry.register(Gauge(
+    "vrchat_bridge_cache_entries", "Entries in the memory cache", collect=lambda: {(): len(response_cache._entries)}
+))
+registry.register(Gauge(
+    "vrchat_bridge_cache_bytes", "Bytes held by the memory cache", collect=lambda: {(): response_cache.current_bytes}
+))
+registry.register(Gauge(
+    "vrchat_bridge_upstream_pool_connections", "Connections in the upstream pool, by state", ("state",),
+    collect=lambda: {(state,): count for state, count in pool_stats().items() if state != "waiting"}
+))
+registry.register(Gauge(
+    "vrchat_bridge_upstream_pool_waiting", "Calls waiting for a free upstream connection",
+    collect=lambda: {(): pool_stats().get("waiting", 0)}
+))
+registry.register(Gauge(
+    "vrchat_bridge_upstream_coalesced_in_flight", "Distinct upstream calls shared by concurrent identical requests",
+    collect=lambda: {(): len(upstream_flights)}
+))
+registry.register(Gauge(
+    "vrchat_bridge_upstream_limiter_queued", "Calls queued by the outbound rate limiter",
+    collect=lambda: {(): outbound_limiter.queued()}
+))
+
+_URL_WORD = re.compile(r"^[A-Za-z]+$")
+
+def upstream_endpoint(path: str) -> str:
+    """VRChat path as a template: IDs and other variable segments become {id}, keeping label values bounded"""
+    return "/" + "/".join(segment if _URL_WORD.match(segment) else "{id}" for segment in path.strip("/").split("/"))
+
+def route_template(scope: dict) -> str:
+    """Template of the route that handled a request, e.g. /api/users/{user_id}"""
+    template = getattr(scope.get("route"), "path_format", None)
+    if template is None:
+        return "unmatched"
+    # Routes of included routers may not carry the router prefix: recover it from the concrete path
+    try:
+        tail = template.format(**scope.get("path_params", {}))
+    except (KeyError, IndexError, ValueError):
+        return template
+    path = scope.get("path", "")
+    return path[:len(path) - len(tail)] + template if tail and path.endswith(tail) else template
+
+def is_metrics_scraper(authorization: Optional[str]) -> bool:
+    """Whether an Authorization header carries METRICS_TOKEN; never true while the endpoint is disabled"""
+    if not METRICS_TOKEN or not authorization:
+        return False
+    return hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode())
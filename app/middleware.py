@@ -2,117 +2,433 @@
 Rate limiting and security middleware
 """
 import time
-from collections import defaultdict, deque
-from typing import Dict, Deque
-from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
+from typing import Optional
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.cache import encoded_etag, make_etag
+from app.metrics import http_request_duration, http_requests, http_requests_in_flight, is_metrics_scraper, rate_limit_rejections, route_template
+from app.profiling import PROFILE_HEADER, current_profile, profile_captures, stack_sampler, start_profile
+from app.compression import StreamCompressor, accepted_encoding, compress, is_compressible, negotiate_encoding
+from app.rate_limit import RateLimitBackend, MemoryRateLimitBackend
 import logging
 
 logger = logging.getLogger(__name__)
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
+class RateLimitMiddleware:
     """
-    Rate limiting middleware using sliding window algorithm
+    Rate limiting middleware using sliding window counters kept in a pluggable backend.
+    Plain ASGI: rate limit headers are added on http.response.start, so responses
+    (including streaming ones) pass through untouched.
     """
-    def __init__(self, app, calls_per_minute: int = 60, calls_per_hour: int = 1000):
-        super().__init__(app)
+    def __init__(self, app: ASGIApp, calls_per_minute: int = 60, calls_per_hour: int = 1000, backend: Optional[RateLimitBackend] = None):
+        self.app = app
         self.calls_per_minute = calls_per_minute
         self.calls_per_hour = calls_per_hour
         
-        # Store requests by IP: {ip: deque of timestamps}
-        self.requests: Dict[str, Deque[float]] = defaultdict(deque)
+        # Per-process memory unless a shared backend is given
+        self.backend = backend or MemoryRateLimitBackend()
         
-    def get_client_ip(self, request: Request) -> str:
+    def get_client_ip(self, scope: Scope) -> str:
         """Get client IP with support for proxies"""
+        headers = Headers(scope=scope)
+        
         # Check for forwarded headers (common in reverse proxy setups)
-        forwarded_for = request.headers.get("X-Forwarded-For")
+        forwarded_for = headers.get("X-Forwarded-For")
         if forwarded_for:
             # Take the first IP in the chain
             return forwarded_for.split(",")[0].strip()
         
-        real_ip = request.headers.get("X-Real-IP")
+        real_ip = headers.get("X-Real-IP")
         if real_ip:
             return real_ip
             
         # Fallback to direct connection
-        return request.client.host if request.client else "unknown"
-    
-    def cleanup_old_requests(self, ip: str, current_time: float):
-        """Remove requests older than 1 hour"""
-        requests = self.requests[ip]
-        cutoff_time = current_time - 3600  # 1 hour ago
-        
-        while requests and requests[0] < cutoff_time:
-            requests.popleft()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
     
-    def is_rate_limited(self, ip: str, current_time: float) -> tuple[bool, str]:
-        """Check if IP is rate limited"""
-        self.cleanup_old_requests(ip, current_time)
-        requests = self.requests[ip]
-        
-        # Check minute limit
-        minute_cutoff = current_time - 60
-        minute_requests = sum(1 for req_time in requests if req_time > minute_cutoff)
-        
-        if minute_requests >= self.calls_per_minute:
-            return True, f"Rate limit exceeded: {minute_requests}/{self.calls_per_minute} requests per minute"
-        
-        # Check hour limit
-        if len(requests) >= self.calls_per_hour:
-            return True, f"Rate limit exceeded: {len(requests)}/{self.calls_per_hour} requests per hour"
-        
-        return False, ""
+    async def check_and_record(self, ip: str, current_time: float) -> tuple[bool, str, int, int]:
+        """
+        Check the IP's limits and count the request if it is allowed, in one backend call.
+        Returns (limited, message, remaining minute allowance, remaining hour allowance).
+        """
+        allowed, minute_requests, hour_requests = await self.backend.acquire(
+            ip, current_time, self.calls_per_minute, self.calls_per_hour
+        )
+        if not allowed:
+            if minute_requests >= self.calls_per_minute:
+                rate_limit_rejections.inc("minute")
+                return True, f"Rate limit exceeded: {int(minute_requests)}/{self.calls_per_minute} requests per minute", 0, 0
+            rate_limit_rejections.inc("hour")
+            return True, f"Rate limit exceeded: {int(hour_requests)}/{self.calls_per_hour} requests per hour", 0, 0
+        return (
+            False,
+            "",
+            max(0, self.calls_per_minute - int(minute_requests)),
+            max(0, self.calls_per_hour - int(hour_requests))
+        )
     
-    async def dispatch(self, request: Request, call_next):
-        # Skip rate limiting for health checks and docs
-        if request.url.path in ["/api/health", "/docs", "/openapi.json"]:
-            return await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Skip rate limiting for non-HTTP traffic, health checks, docs and authenticated metrics scrapes
+        if scope["type"] != "http" or scope["path"] in ["/api/health", "/docs", "/openapi.json"] or (
+            scope["path"] == "/api/metrics" and is_metrics_scraper(Headers(scope=scope).get("authorization"))
+        ):
+            await self.app(scope, receive, send)
+            return
         
-        client_ip = self.get_client_ip(request)
+        client_ip = self.get_client_ip(scope)
         current_time = time.time()
         
-        # Check if rate limited
-        is_limited, message = self.is_rate_limited(client_ip, current_time)
+        # Check if rate limited and record this request; a shared backend being unreachable must not take the API down
+        try:
+            is_limited, message, remaining_minute, remaining_hour = await self.check_and_record(client_ip, current_time)
+        except Exception as e:
+            logger.error(f"Rate limit backend unavailable, allowing request: {e}")
+            await self.app(scope, receive, send)
+            return
         
         if is_limited:
             logger.warning(f"Rate limit exceeded for IP {client_ip}: {message}")
-            raise HTTPException(
+            response = JSONResponse(
                 status_code=429,
-                detail="Rate limit exceeded. Please try again later.",
+                content={"error": "Rate limit exceeded. Please try again later.", "code": 429},
                 headers={"Retry-After": "60"}
             )
-        
-        # Record this request
-        self.requests[client_ip].append(current_time)
+            await response(scope, receive, send)
+            return
         
         # Add rate limit headers to response
-        response = await call_next(request)
+        rate_limit_headers = [
+            (b"x-ratelimit-limit-minute", str(self.calls_per_minute).encode()),
+            (b"x-ratelimit-remaining-minute", str(remaining_minute).encode()),
+            (b"x-ratelimit-limit-hour", str(self.calls_per_hour).encode()),
+            (b"x-ratelimit-remaining-hour", str(remaining_hour).encode()),
+        ]
         
-        # Calculate remaining requests
-        requests = self.requests[client_ip]
-        minute_cutoff = current_time - 60
-        minute_requests = sum(1 for req_time in requests if req_time > minute_cutoff)
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *rate_limit_headers]
+            await send(message)
         
-        response.headers["X-RateLimit-Limit-Minute"] = str(self.calls_per_minute)
-        response.headers["X-RateLimit-Remaining-Minute"] = str(max(0, self.calls_per_minute - minute_requests))
-        response.headers["X-RateLimit-Limit-Hour"] = str(self.calls_per_hour)
-        response.headers["X-RateLimit-Remaining-Hour"] = str(max(0, self.calls_per_hour - len(requests)))
-        
-        return response
+        await self.app(scope, receive, send_with_headers)
+
+
+class MetricsMiddleware:
+    """
+    Count and time HTTP requests by route template (e.g. /api/users/{user_id}),
+    which is only known once routing has run further down the stack
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            route = route_template(scope)
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], route)
+            http_requests.inc(scope["method"], route, str(status))
+
+
+class ProfilingMiddleware:
+    """
+    Time profiled requests (see app.profiling) from the outside of the middleware stack.
+    A Server-Timing header splits the time until the response starts into middleware,
+    upstream wait, JSON serialization and the rest of the handler; slow and
+    stack-sampled requests are then captured for the admin endpoints.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile = start_profile(Headers(scope=scope).get(PROFILE_HEADER))
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_timing(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                server_timing = profile.server_timing(time.perf_counter()).encode()
+                message["headers"] = [*message.get("headers", ()), (b"server-timing", server_timing)]
+            await send(message)
+
+        token = current_profile.set(profile)
+        if profile.sampled:
+            stack_sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if profile.sampled:
+                stack_sampler.remove(profile)
+            current_profile.reset(token)
+            profile_captures.finish(profile, scope["method"], scope["path"], route_template(scope), status)
+
+
+class HandlerTimingMiddleware:
+    """
+    Innermost half of ProfilingMiddleware: marks when a profiled request reaches
+    the application and when it leaves it, so the time spent in the middleware
+    stack around it can be told apart
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        profile = current_profile.get()
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
+        async def send_timed(message: Message):
+            # Buffering and compressing the response happen in the middleware above
+            profile.enter("send")
+            try:
+                await send(message)
+            finally:
+                profile.exit("send")
+
+        profile.handler_started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            profile.handler_finished = time.perf_counter()
+
+
+class SecurityHeadersMiddleware:
     """Add security headers to all responses"""
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        response.headers["Content-Security-Policy"] = "default-src 'self' https://cdn.jsdelivr.net https://fastapi.tiangolo.com; script-src 'self' https://cdn.jsdelivr.net 'unsafe-inline'; style-src 'self' https://cdn.jsdelivr.net 'unsafe-inline'; img-src 'self' https://fastapi.tiangolo.com data:"
+    SECURITY_HEADERS = [
+        (b"x-content-type-options", b"nosniff"),
+        (b"x-frame-options", b"DENY"),
+        (b"x-xss-protection", b"1; mode=block"),
+        (b"referrer-policy", b"strict-origin-when-cross-origin"),
+        (b"content-security-policy", b"default-src 'self' https://cdn.jsdelivr.net https://fastapi.tiangolo.com; script-src 'self' https://cdn.jsdelivr.net 'unsafe-inline'; style-src 'self' https://cdn.jsdelivr.net 'unsafe-inline'; img-src 'self' https://fastapi.tiangolo.com data:"),
+    ]
+    # Only added for HTTPS requests
+    HSTS_HEADER = (b"strict-transport-security", b"max-age=31536000; includeSubDomains")
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        extra_headers = self.SECURITY_HEADERS
+        if scope.get("scheme") == "https":
+            extra_headers = [*extra_headers, self.HSTS_HEADER]
         
-        # Only add HSTS for HTTPS requests
-        if request.url.scheme == "https":
-            response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *extra_headers]
+            await send(message)
         
-        return response
\ No newline at end of file
+        await self.app(scope, receive, send_with_headers)
+
+
+class ETagMiddleware:
+    """
+    Strong ETags and If-None-Match handling for GET requests.
+    Responses that already carry an ETag (precomputed by the response cache) are used as is;
+    other complete 200 responses are hashed. Streaming responses are left alone.
+    When the client already has the current version, a bodiless 304 is sent instead.
+    Sits inside CompressionMiddleware, which tags compressed bodies with their encoding:
+    a client holding the compressed version of the body is matched too.
+    """
+    # Headers kept on a 304, as required by RFC 9110 section 15.4.5
+    NOT_MODIFIED_HEADERS = {b"etag", b"cache-control", b"content-location", b"date", b"expires", b"vary", b"x-cache"}
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    @staticmethod
+    def matches(if_none_match: str, etag: str) -> bool:
+        """Weak comparison, as used for If-None-Match"""
+        if if_none_match.strip() == "*":
+            return True
+        etag = etag.removeprefix("W/")
+        return any(candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(","))
+
+    @classmethod
+    def matching_etag(cls, if_none_match: str, etag: str, encoding: Optional[str]) -> Optional[str]:
+        """The tag the client holds, for the identity or the compressed body, if it is current"""
+        for tag in (etag, encoded_etag(etag, encoding)) if encoding else (etag,):
+            if cls.matches(if_none_match, tag):
+                return tag
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        encoding = accepted_encoding.get()
+        start: Optional[Message] = None
+        passthrough = False
+        not_modified = False
+
+        async def send_not_modified(message: Message, etag: str):
+            headers = [
+                (name, value) for name, value in message.get("headers", ())
+                if name.lower() in self.NOT_MODIFIED_HEADERS and name.lower() != b"etag"
+            ]
+            # The 304 carries the tag of the version the client holds
+            headers.append((b"etag", etag.encode("latin-1")))
+            await send({**message, "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+        async def send_with_etag(message: Message):
+            nonlocal start, passthrough, not_modified
+            if passthrough:
+                await send(message)
+                return
+            if not_modified:
+                return
+            if message["type"] == "http.response.start":
+                if message["status"] != 200:
+                    passthrough = True
+                    await send(message)
+                    return
+                etag = next((value for name, value in message.get("headers", ()) if name.lower() == b"etag"), None)
+                if etag is None:
+                    # Hash once the body is known
+                    start = message
+                    return
+                matched = if_none_match and self.matching_etag(if_none_match, etag.decode("latin-1"), encoding)
+                if matched:
+                    not_modified = True
+                    await send_not_modified(message, matched)
+                    return
+                passthrough = True
+                await send(message)
+                return
+
+            if message["type"] == "http.response.body" and start is not None:
+                if message.get("more_body", False):
+                    # Streaming response: no ETag
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                etag = make_etag(message.get("body", b"")).encode("latin-1")
+                start["headers"] = [*start.get("headers", ()), (b"etag", etag)]
+                matched = if_none_match and self.matching_etag(if_none_match, etag.decode("latin-1"), encoding)
+                if matched:
+                    not_modified = True
+                    await send_not_modified(start, matched)
+                    return
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with the best encoding the client accepts (zstd, br or gzip).
+    Complete bodies under the minimum size are sent as is; streaming responses are
+    compressed chunk by chunk. Responses that are already encoded (cached bodies
+    served precompressed) pass through untouched.
+    """
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, level: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        passthrough = False
+        stream: Optional[StreamCompressor] = None
+
+        def encoded_headers(message: Message, length: Optional[int]) -> list:
+            headers = []
+            for name, value in message.get("headers", ()):
+                if name.lower() == b"etag":
+                    # Each content coding gets its own strong validator
+                    value = encoded_etag(value.decode("latin-1"), encoding).encode("latin-1")
+                elif name.lower() == b"content-length":
+                    continue
+                headers.append((name, value))
+            headers.append((b"content-encoding", encoding.encode()))
+            headers.append((b"vary", b"Accept-Encoding"))
+            if length is not None:
+                headers.append((b"content-length", str(length).encode()))
+            return headers
+
+        async def send_compressed(message: Message):
+            nonlocal start, passthrough, stream
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message.get("headers", []))
+                if "content-encoding" in headers or not is_compressible(headers.get("content-type", "")):
+                    passthrough = True
+                    await send(message)
+                    return
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is not None:
+                data = stream.chunk(body) + (b"" if more_body else stream.finish())
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+                return
+            if not more_body:
+                # Complete body known up front
+                passthrough = True
+                if len(body) < self.minimum_size:
+                    await send(start)
+                    await send(message)
+                    return
+                data = compress(body, encoding, self.level)
+                await send({**start, "headers": encoded_headers(start, len(data))})
+                await send({"type": "http.response.body", "body": data, "more_body": False})
+                return
+            stream = StreamCompressor(encoding, self.level)
+            await send({**start, "headers": encoded_headers(start, None)})
+            await send({"type": "http.response.body", "body": stream.chunk(body), "more_body": True})
+
+        token = accepted_encoding.set(encoding)
+        try:
+            await self.app(scope, receive, send_compressed)
+        finally:
+            accepted_encoding.reset(token)
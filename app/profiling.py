@@ -0,0 +1,251 @@
+"""
+Opt-in request profiling: Server-Timing breakdowns, stack sampling and slow-request capture.
+A profiled request measures where its time goes (middleware stack, waiting on VRChat,
+JSON encoding and decoding, the rest of the handler) and, when chosen for it, has its stack
+sampled from a background thread. Slow and chosen requests are kept in a small per-worker
+ring buffer that admins can download as folded stacks (flamegraph.pl, speedscope...).
+"""
+import asyncio
+import contextlib
+import hashlib
+import hmac
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import Deque, Dict, List, Optional, Tuple
+from app.env import ADMIN_TOKEN, PROFILING_ENABLED, PROFILING_SAMPLE_RATE, PROFILING_SLOW_THRESHOLD_MS, PROFILING_MAX_CAPTURES, PROFILING_INTERVAL_MS
+
+# Request header carrying a token from POST /api/admin/profiles/token
+PROFILE_HEADER = "x-profile"
+MAX_TOKEN_TTL = 3600
+MAX_STACK_DEPTH = 200
+
+class RequestProfile:
+    """Timings of one request, and its stack samples when 'sampled'"""
+    def __init__(self, sampled: bool, reason: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.sampled = sampled
+        self.reason = reason
+        self.started = time.perf_counter()
+        self.handler_started: Optional[float] = None
+        self.handler_finished: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.samples: Counter = Counter()
+        # kind -> [seconds spent, spans open, start of the outermost open span]
+        self._spans: Dict[str, List[float]] = {}
+
+    def enter(self, kind: str):
+        span = self._spans.get(kind)
+        if span is None:
+            span = self._spans[kind] = [0.0, 0, 0.0]
+        if span[1] == 0:
+            span[2] = time.perf_counter()
+        span[1] += 1
+
+    def exit(self, kind: str):
+        span = self._spans[kind]
+        span[1] -= 1
+        if span[1] == 0:
+            span[0] += time.perf_counter() - span[2]
+
+    def spent(self, kind: str, now: float) -> float:
+        """Wall time with at least one span of this kind open: concurrent upstream calls are not double counted"""
+        span = self._spans.get(kind)
+        if span is None:
+            return 0.0
+        return span[0] + (now - span[2] if span[1] else 0.0)
+
+    def breakdown(self, now: float) -> Dict[str, float]:
+        """Milliseconds since the request came in, split between the middleware stack and the handler"""
+        handler = 0.0
+        if self.handler_started is not None:
+            handler = (self.handler_finished or now) - self.handler_started - self.spent("send", now)
+        upstream, serialize = self.spent("upstream", now), self.spent("serialize", now)
+        timings = {
+            "total": now - self.started,
+            "middleware": now - self.started - handler,
+            "upstream": upstream,
+            "serialize": serialize,
+            "app": max(0.0, handler - upstream - serialize)
+        }
+        return {name: round(seconds * 1000, 3) for name, seconds in timings.items()}
+
+    def server_timing(self, now: float) -> str:
+        return ", ".join(f"{name};dur={value}" for name, value in self.breakdown(now).items())
+
+    def sample(self, running: Optional[asyncio.Task], frame: Optional[FrameType]):
+        """Record where the request is: on the CPU (the loop thread's stack) or awaiting (its coroutine chain)"""
+        coro = self.task.get_coro() if self.task is not None else None
+        if coro is None:
+            return
+        if running is self.task and frame is not None:
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stack.reverse()
+            # Drop the event loop frames above the request's own coroutine
+            root = getattr(coro, "cr_code", None)
+            if root in stack:
+                stack = stack[stack.index(root):]
+            self.samples[";".join(["(running)", *map(_label, stack)])] += 1
+            return
+        stack = []
+        while coro is not None and len(stack) < MAX_STACK_DEPTH:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+            if frame is None:
+                break
+            stack.append(frame.f_code)
+            coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+        self.samples[";".join(["(waiting)", *map(_label, stack)])] += 1
+
+_labels: Dict[CodeType, str] = {}
+
+def _label(code: CodeType) -> str:
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{code.co_qualname} ({'/'.join(Path(code.co_filename).parts[-2:])}:{code.co_firstlineno})"
+    return label
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+def span(kind: str):
+    """Context manager adding the time spent inside it to the current request's 'kind' timing, if it is profiled"""
+    profile = current_profile.get()
+    return contextlib.nullcontext() if profile is None else _Span(profile, kind)
+
+class _Span:
+    __slots__ = ("profile", "kind")
+
+    def __init__(self, profile: RequestProfile, kind: str):
+        self.profile = profile
+        self.kind = kind
+
+    def __enter__(self):
+        self.profile.enter(self.kind)
+
+    def __exit__(self, *exc_info):
+        self.profile.exit(self.kind)
+
+def _sign(expires: int) -> str:
+    return hmac.new(ADMIN_TOKEN.encode(), f"profile:{expires}".encode(), hashlib.sha256).hexdigest()
+
+def make_profile_token(ttl: int) -> Tuple[str, int]:
+    """Token for the X-Profile header, signed with ADMIN_TOKEN and valid for 'ttl' seconds"""
+    expires = int(time.time()) + min(max(ttl, 1), MAX_TOKEN_TTL)
+    return f"{expires}.{_sign(expires)}", expires
+
+def verify_profile_token(token: str) -> bool:
+    if not ADMIN_TOKEN:
+        return False
+    expires, _, signature = token.partition(".")
+    try:
+        expires_at = int(expires)
+    except ValueError:
+        return False
+    return expires_at >= time.time() and hmac.compare_digest(signature, _sign(expires_at))
+
+def start_profile(profile_header: Optional[str]) -> Optional[RequestProfile]:
+    """
+    Profile for a new request, or None when it is not profiled. A valid X-Profile token
+    always gets a stack profile; with PROFILING_ENABLED every request is timed and
+    PROFILING_SAMPLE_RATE of them are stack sampled.
+    """
+    if profile_header is not None and verify_profile_token(profile_header):
+        return RequestProfile(sampled=True, reason="requested")
+    if not PROFILING_ENABLED:
+        return None
+    if PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE:
+        return RequestProfile(sampled=True, reason="sampled")
+    return RequestProfile(sampled=False, reason="slow")
+
+class StackSampler:
+    """
+    Thread sampling the event loop thread every 'interval' seconds while sampled requests
+    are in flight, and idle otherwise. Samples land in the profile of the request they belong to.
+    Sync endpoints run in the threadpool and are only seen as waiting.
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._profiles: Dict[asyncio.Task, RequestProfile] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id = 0
+
+    def add(self, profile: RequestProfile):
+        """Start sampling the calling task, which must be the request's"""
+        profile.task = asyncio.current_task()
+        with self._lock:
+            self._profiles[profile.task] = profile
+            if self._thread is None:
+                self._loop = asyncio.get_running_loop()
+                self._loop_thread_id = threading.get_ident()
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles.pop(profile.task, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                profiles = list(self._profiles.values())
+                loop, thread_id = self._loop, self._loop_thread_id
+            running = asyncio.current_task(loop)
+            frame = sys._current_frames().get(thread_id)
+            for profile in profiles:
+                profile.sample(running, frame)
+
+class ProfileCaptures:
+    """Ring buffer of the last captured requests: slow ones and the ones chosen for stack sampling"""
+    def __init__(self, max_captures: int, slow_threshold: float):
+        self.slow_threshold = slow_threshold
+        self._captures: Deque[dict] = deque(maxlen=max_captures)
+
+    def finish(self, profile: RequestProfile, method: str, path: str, route: str, status: int):
+        now = time.perf_counter()
+        if not profile.sampled and now - profile.started < self.slow_threshold:
+            return
+        self._captures.append({
+            "id": profile.id,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "reason": profile.reason,
+            "method": method,
+            "path": path,
+            "route": route,
+            "status": status,
+            "timing_ms": profile.breakdown(now),
+            "samples": sum(profile.samples.values()),
+            "profile": dict(profile.samples)
+        })
+
+    def list(self) -> List[dict]:
+        """Captures without their stacks, newest first"""
+        return [{key: value for key, value in capture.items() if key != "profile"} for capture in reversed(self._captures)]
+
+    def get(self, capture_id: str) -> Optional[dict]:
+        return next((capture for capture in self._captures if capture["id"] == capture_id), None)
+
+    def clear(self) -> int:
+        cleared = len(self._captures)
+        self._captures.clear()
+        return cleared
+
+def folded_stacks(capture: dict) -> str:
+    """A capture's samples in the folded format: one 'frame;frame;frame count' line per distinct stack"""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(capture["profile"].items()))
+
+stack_sampler = StackSampler(PROFILING_INTERVAL_MS / 1000)
+profile_captures = ProfileCaptures(PROFILING_MAX_CAPTURES, PROFILING_SLOW_THRESHOLD_MS / 1000)
@@ -0,0 +1,394 @@
+"""
+Rate limit storage backends shared by RateLimitMiddleware
+
+Every backend keeps two sliding window counters per client (one minute, one hour),
+approximated from the current and previous fixed windows so that counting and
+recording are O(1). Checking the limits and counting a request is one atomic step,
+so concurrent workers cannot all pass the check and overshoot the limit.
+The in-memory backend is per process; the Redis and shared file backends let
+several workers or containers enforce one common limit.
+"""
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import struct
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
+from app.env import (
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_MAX_CLIENTS,
+    RATE_LIMIT_REDIS_URL,
+    RATE_LIMIT_REDIS_TIMEOUT,
+    RATE_LIMIT_FILE,
+    RATE_LIMIT_FILE_SLOTS
+)
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60
+HOUR = 3600
+
+def sliding_window_count(current: int, previous: int, size: int, now: float) -> float:
+    """Estimate the requests in the last `size` seconds from two fixed window counts"""
+    overlap = 1 - (now % size) / size
+    return previous * overlap + current
+
+class RateLimitBackend(ABC):
+    """Interface for rate limit storage"""
+    @abstractmethod
+    async def acquire(self, key: str, now: float, minute_limit: int, hour_limit: int) -> Tuple[bool, float, float]:
+        """
+        Record a request for a client unless it already reached one of the limits.
+        Returns whether it was recorded and the (minute, hour) estimates, this request included.
+        """
+
+    async def close(self):
+        pass
+
+
+class SlidingWindow:
+    """Fixed window counter that remembers the previous window's count"""
+    __slots__ = ("size", "start", "current", "previous")
+
+    def __init__(self, size: int, now: float):
+        self.size = size
+        self.start = now - now % size
+        self.current = 0
+        self.previous = 0
+
+    def _roll(self, now: float):
+        start = now - now % self.size
+        if start != self.start:
+            # Only the immediately preceding window still overlaps the sliding window
+            self.previous = self.current if start - self.start == self.size else 0
+            self.current = 0
+            self.start = start
+
+    def count(self, now: float) -> float:
+        self._roll(now)
+        return sliding_window_count(self.current, self.previous, self.size, now)
+
+    def hit(self, now: float):
+        self._roll(now)
+        self.current += 1
+
+class ClientWindows:
+    __slots__ = ("minute", "hour", "last_seen")
+
+    def __init__(self, now: float):
+        self.minute = SlidingWindow(MINUTE, now)
+        self.hour = SlidingWindow(HOUR, now)
+        self.last_seen = now
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """
+    Per-process backend with bounded memory: clients are kept in last-seen order,
+    idle ones are dropped after an hour and the least recently seen are evicted past max_clients
+    """
+    def __init__(self, max_clients: int = 100000):
+        self.max_clients = max_clients
+        self.clients: "OrderedDict[str, ClientWindows]" = OrderedDict()
+
+    def get_windows(self, key: str, now: float) -> ClientWindows:
+        """Get (or start tracking) a client's windows and mark it as recently seen"""
+        windows = self.clients.get(key)
+        if windows is None:
+            # Memory only grows here, so this is the only place that needs to sweep
+            self.cleanup(now)
+            windows = self.clients[key] = ClientWindows(now)
+        else:
+            self.clients.move_to_end(key)
+            windows.last_seen = now
+        return windows
+
+    def cleanup(self, now: float):
+        """Forget clients idle for more than 1 hour, and the least recently seen beyond max_clients"""
+        cutoff_time = now - HOUR
+        clients = self.clients
+        # Only the front of the last-seen order needs checking
+        while clients:
+            oldest = next(iter(clients.values()))
+            if oldest.last_seen >= cutoff_time and len(clients) < self.max_clients:
+                break
+            clients.popitem(last=False)
+
+    async def acquire(self, key: str, now: float, minute_limit: int, hour_limit: int) -> Tuple[bool, float, float]:
+        windows = self.get_windows(key, now)
+        minute, hour = windows.minute.count(now), windows.hour.count(now)
+        if minute >= minute_limit or hour >= hour_limit:
+            return False, minute, hour
+        windows.minute.hit(now)
+        windows.hour.hit(now)
+        return True, minute + 1, hour + 1
+
+
+class RedisError(RuntimeError):
+    pass
+
+class RedisConnection:
+    """
+    Minimal RESP2 client over a single asyncio connection, enough for pipelined
+    counter commands without pulling in a Redis library. Every call, including the
+    wait for the connection and connecting, gives up after 'timeout' seconds.
+    """
+    def __init__(self, url: str, timeout: float = 0.5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            # Returned rather than raised so the rest of a pipeline is still read off the socket
+            return RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            self._writer.write(b"".join(self._encode(*command) for command in setup))
+            await self._writer.drain()
+            for _ in setup:
+                reply = await self._read_reply()
+                if isinstance(reply, RedisError):
+                    raise reply
+
+    async def evalsha(self, script: "RedisScript", keys: List[str], args: List) -> object:
+        """Run a Lua script by its hash, sending its source only if Redis does not know it yet"""
+        try:
+            (reply,) = await self.pipeline(("EVALSHA", script.sha, len(keys), *keys, *args))
+        except RedisError as e:
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            (reply,) = await self.pipeline(("EVAL", script.source, len(keys), *keys, *args))
+        return reply
+
+    async def pipeline(self, *commands: tuple) -> List:
+        """Send several commands in one round trip and return their replies"""
+        replies = await asyncio.wait_for(self._round_trip(commands), self.timeout)
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    async def _round_trip(self, commands: Tuple[tuple, ...]) -> List:
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    await self._connect()
+                self._writer.write(b"".join(self._encode(*command) for command in commands))
+                await self._writer.drain()
+                return [await self._read_reply() for _ in commands]
+            except (Exception, asyncio.CancelledError):
+                # Timed out or failed midway: replies may still be in flight, so the connection cannot be reused
+                await self.close()
+                raise
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+class RedisScript:
+    def __init__(self, source: str):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode()).hexdigest()
+
+# Check both sliding windows and count the request only if it is allowed, atomically on the server.
+# KEYS: minute, previous minute, hour, previous hour counters
+# ARGV: weight of the previous minute and hour, minute and hour limits, minute and hour key lifetimes
+# Returns {allowed, minute estimate, hour estimate}, estimates as strings since Lua numbers become integers
+ACQUIRE_SCRIPT = RedisScript("""
+local minute = tonumber(redis.call('GET', KEYS[1]) or 0)
+local hour = tonumber(redis.call('GET', KEYS[3]) or 0)
+local previous_minute = tonumber(redis.call('GET', KEYS[2]) or 0) * tonumber(ARGV[1])
+local previous_hour = tonumber(redis.call('GET', KEYS[4]) or 0) * tonumber(ARGV[2])
+if previous_minute + minute >= tonumber(ARGV[3]) or previous_hour + hour >= tonumber(ARGV[4]) then
+    return {0, tostring(previous_minute + minute), tostring(previous_hour + hour)}
+end
+minute = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+hour = redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[6])
+return {1, tostring(previous_minute + minute), tostring(previous_hour + hour)}
+""")
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Backend storing one counter key per client and fixed window in Redis, expired by Redis itself.
+    Each request is one round trip running ACQUIRE_SCRIPT.
+    """
+    def __init__(self, url: str, prefix: str = "vrchat-bridge:ratelimit:", timeout: float = 0.5):
+        self.redis = RedisConnection(url, timeout)
+        self.prefix = prefix
+
+    def _keys(self, key: str, size: int, now: float) -> Tuple[str, str]:
+        # The hash tag keeps a client's keys in one slot, as scripts require on Redis Cluster
+        index = int(now // size)
+        return f"{self.prefix}{{{key}}}:{size}:{index}", f"{self.prefix}{{{key}}}:{size}:{index - 1}"
+
+    async def acquire(self, key: str, now: float, minute_limit: int, hour_limit: int) -> Tuple[bool, float, float]:
+        minute_key, previous_minute_key = self._keys(key, MINUTE, now)
+        hour_key, previous_hour_key = self._keys(key, HOUR, now)
+        allowed, minute, hour = await self.redis.evalsha(
+            ACQUIRE_SCRIPT,
+            [minute_key, previous_minute_key, hour_key, previous_hour_key],
+            [
+                1 - (now % MINUTE) / MINUTE, 1 - (now % HOUR) / HOUR,
+                minute_limit, hour_limit, 2 * MINUTE, 2 * HOUR
+            ]
+        )
+        return bool(allowed), float(minute), float(hour)
+
+    async def close(self):
+        await self.redis.close()
+
+
+class SharedFileRateLimitBackend(RateLimitBackend):
+    """
+    Backend for several workers on one host: a fixed-size hash table of counters in a
+    memory-mapped file, guarded by an exclusive file lock. Each client hashes to a short
+    probe sequence of slots; when all of them are taken the stalest one is recycled,
+    so the file never grows. The lock is only ever tried without blocking: a worker
+    that finds it taken yields to its event loop and retries.
+    """
+    # key hash, minute index, minute count, previous minute count, hour index, hour count, previous hour count
+    SLOT = struct.Struct("<QqIIqII")
+    PROBES = 8
+
+    def __init__(self, path: Path, slots: int = 131072):
+        import fcntl  # Unix only, imported lazily so other backends work everywhere
+        self._fcntl = fcntl
+        self.slots = slots
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * self.SLOT.size
+        if os.fstat(self._fd).st_size != size:
+            with self._locked():
+                if os.fstat(self._fd).st_size != size:
+                    os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    # Retry delays while another worker holds the lock, in seconds
+    LOCK_RETRY_MIN = 0.0001
+    LOCK_RETRY_MAX = 0.01
+
+    @contextmanager
+    def _locked(self, blocking: bool = True):
+        """Hold the file lock; raises BlockingIOError if it is taken and 'blocking' is false"""
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_EX if blocking else self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+        try:
+            yield
+        finally:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # Stable across processes, unlike hash(); 0 marks an empty slot
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+    @staticmethod
+    def _roll(index: int, current: int, previous: int, now_index: int) -> Tuple[int, int, int]:
+        if index == now_index:
+            return index, current, previous
+        if index == now_index - 1:
+            return now_index, 0, current
+        return now_index, 0, 0
+
+    def _find_slot(self, key_hash: int, hour_index: int) -> Tuple[int, tuple]:
+        slot_size = self.SLOT.size
+        start = key_hash % self.slots
+        victim, victim_age = None, None
+        for probe in range(self.PROBES):
+            slot = (start + probe) % self.slots
+            record = self.SLOT.unpack_from(self._map, slot * slot_size)
+            if record[0] == key_hash:
+                return slot, record
+            if record[0] == 0 or record[4] < hour_index - 1:
+                # Empty, or too old to matter any more
+                return slot, (key_hash, 0, 0, 0, 0, 0, 0)
+            if victim_age is None or record[4] < victim_age:
+                victim, victim_age = slot, record[4]
+        return victim, (key_hash, 0, 0, 0, 0, 0, 0)
+
+    def _acquire(self, key_hash: int, now: float, minute_limit: int, hour_limit: int) -> Tuple[bool, float, float]:
+        minute_index, hour_index = int(now // MINUTE), int(now // HOUR)
+        with self._locked(blocking=False):
+            slot, record = self._find_slot(key_hash, hour_index)
+            m_index, m_current, m_previous = self._roll(record[1], record[2], record[3], minute_index)
+            h_index, h_current, h_previous = self._roll(record[4], record[5], record[6], hour_index)
+            minute = sliding_window_count(m_current, m_previous, MINUTE, now)
+            hour = sliding_window_count(h_current, h_previous, HOUR, now)
+            if minute >= minute_limit or hour >= hour_limit:
+                return False, minute, hour
+            self.SLOT.pack_into(self._map, slot * self.SLOT.size, key_hash, m_index, m_current + 1, m_previous, h_index, h_current + 1, h_previous)
+        return True, minute + 1, hour + 1
+
+    async def acquire(self, key: str, now: float, minute_limit: int, hour_limit: int) -> Tuple[bool, float, float]:
+        key_hash = self._hash(key)
+        delay = self.LOCK_RETRY_MIN
+        while True:
+            try:
+                return self._acquire(key_hash, now, minute_limit, hour_limit)
+            except BlockingIOError:
+                # Another worker holds the lock: never block this worker's event loop waiting for it
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.LOCK_RETRY_MAX)
+
+    async def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+def create_rate_limit_backend() -> RateLimitBackend:
+    """Build the backend selected by RATE_LIMIT_BACKEND"""
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimitBackend(RATE_LIMIT_REDIS_URL, timeout=RATE_LIMIT_REDIS_TIMEOUT)
+    if RATE_LIMIT_BACKEND == "file":
+        return SharedFileRateLimitBackend(Path(RATE_LIMIT_FILE), slots=RATE_LIMIT_FILE_SLOTS)
+    if RATE_LIMIT_BACKEND != "memory":
+        logger.warning(f"Unknown RATE_LIMIT_BACKEND '{RATE_LIMIT_BACKEND}', using in-memory rate limiting")
+    return MemoryRateLimitBackend(max_clients=RATE_LIMIT_MAX_CLIENTS)
@@ -0,0 +1,149 @@
+"""
+In-memory index of users and worlds seen in VRChat responses, to answer type-ahead searches locally
+"""
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+from app.env import (
+    SEARCH_INDEX_ENABLED,
+    SEARCH_INDEX_MAX_ENTRIES,
+    SEARCH_INDEX_MAX_AGE,
+    CACHE_TTL_USERS,
+    CACHE_TTL_WORLDS,
+    CACHE_STALE_WHILE_REVALIDATE
+)
+
+# Field holding the searchable name, per kind
+NAME_KEYS = {"users": "displayName", "worlds": "name"}
+
+# Fields kept for each entity: those of VRChat's search results (LimitedUser / LimitedWorld)
+SUMMARY_KEYS = {
+    "users": (
+        "id", "displayName", "bio", "currentAvatarImageUrl", "currentAvatarThumbnailImageUrl",
+        "currentAvatarTags", "developerType", "isFriend", "last_platform", "profilePicOverride",
+        "status", "statusDescription", "tags", "userIcon"
+    ),
+    "worlds": (
+        "id", "name", "authorId", "authorName", "capacity", "created_at", "favorites", "heat",
+        "imageUrl", "labsPublicizedAt", "occupants", "organization", "popularity",
+        "publicationDate", "releaseStatus", "tags", "thumbnailImageUrl", "updated_at", "visits"
+    ),
+}
+
+def _grams(name: str) -> Set[str]:
+    """Trigrams of the name, plus the first one and two letters of each word (marked with '^')"""
+    grams = {name[i:i + 3] for i in range(len(name) - 2)}
+    for word in name.split():
+        grams.add("^" + word[:1])
+        grams.add("^" + word[:2])
+    return grams
+
+def _query_grams(query: str) -> Set[str]:
+    return {query[i:i + 3] for i in range(len(query) - 2)} if len(query) >= 3 else {"^" + query}
+
+class SearchIndex:
+    """
+    Bounded index of entity summaries (max_entries per kind, least recently seen evicted),
+    with a posting set per trigram. Entities are dropped once older than their kind's
+    max age, so local answers are no staler than the cache would serve.
+    A query is answered locally only when enough entities match it; otherwise the caller
+    goes to VRChat, whose results are indexed in turn.
+    """
+    def __init__(self, max_entries: int = 50000, max_ages: Optional[Dict[str, float]] = None):
+        self.max_entries = max_entries
+        self.max_ages = max_ages or {}
+        self.local_answers = 0
+        # Kept in last-seen order: (folded name, summary, when it was seen)
+        self._entries: Dict[str, "OrderedDict[str, Tuple[str, dict, float]]"] = {kind: OrderedDict() for kind in NAME_KEYS}
+        self._postings: Dict[str, Dict[str, Set[str]]] = {kind: defaultdict(set) for kind in NAME_KEYS}
+
+    def add(self, kind: str, data: Any, now: Optional[float] = None):
+        """Index an entity, or every entity of a list, from a VRChat response"""
+        if kind not in NAME_KEYS:
+            return
+        now = now if now is not None else time.monotonic()
+        for item in data if isinstance(data, list) else (data,):
+            if isinstance(item, dict):
+                self._add_one(kind, item, now)
+        self._expire(kind, now)
+
+    def _add_one(self, kind: str, item: dict, now: float):
+        entity_id, name = item.get("id"), item.get(NAME_KEYS[kind])
+        if not isinstance(entity_id, str) or not isinstance(name, str) or not name:
+            return
+        entries = self._entries[kind]
+        if entity_id in entries:
+            self._remove(kind, entity_id)
+        folded = name.casefold()
+        entries[entity_id] = (folded, {key: item[key] for key in SUMMARY_KEYS[kind] if key in item}, now)
+        postings = self._postings[kind]
+        for gram in _grams(folded):
+            postings[gram].add(entity_id)
+        while len(entries) > self.max_entries:
+            self._remove(kind, next(iter(entries)))
+
+    def _expire(self, kind: str, now: float):
+        """Drop entities seen longer ago than the kind's max age, from the front of the last-seen order"""
+        max_age = self.max_ages.get(kind)
+        if not max_age:
+            return
+        entries = self._entries[kind]
+        cutoff = now - max_age
+        while entries:
+            entity_id, (_, _, seen_at) = next(iter(entries.items()))
+            if seen_at >= cutoff:
+                break
+            self._remove(kind, entity_id)
+
+    def _remove(self, kind: str, entity_id: str):
+        folded, _, _ = self._entries[kind].pop(entity_id)
+        postings = self._postings[kind]
+        for gram in _grams(folded):
+            ids = postings.get(gram)
+            if ids is not None:
+                ids.discard(entity_id)
+                if not ids:
+                    del postings[gram]
+
+    def search(self, kind: str, query: str, n: int, now: Optional[float] = None) -> Optional[List[dict]]:
+        """Return up to n matching summaries, or None when fewer than n recent enough ones are known locally"""
+        query = query.strip().casefold()
+        if kind not in NAME_KEYS or not query:
+            return None
+        self._expire(kind, now if now is not None else time.monotonic())
+        postings = self._postings[kind]
+        posting_sets = sorted((postings.get(gram, set()) for gram in _query_grams(query)), key=len)
+        if not posting_sets or len(posting_sets[0]) < n:
+            return None
+        entries = self._entries[kind]
+        matches = []
+        for entity_id in posting_sets[0].intersection(*posting_sets[1:]):
+            folded, summary, _ = entries[entity_id]
+            if query not in folded:
+                continue
+            # Whole name prefix first, then word prefix, then substring; shorter names are closer matches
+            rank = 0 if folded.startswith(query) else 1 if any(word.startswith(query) for word in folded.split()) else 2
+            matches.append((rank, len(folded), folded, summary))
+        if len(matches) < n:
+            return None
+        matches.sort(key=lambda match: match[:3])
+        self.local_answers += 1
+        return [summary for *_, summary in matches[:n]]
+
+    def stats(self) -> dict:
+        return {
+            **{kind: len(entries) for kind, entries in self._entries.items()},
+            "max_entries": self.max_entries,
+            "max_age": self.max_ages,
+            "local_answers": self.local_answers
+        }
+
+def _max_ages() -> Dict[str, float]:
+    if SEARCH_INDEX_MAX_AGE > 0:
+        return {kind: SEARCH_INDEX_MAX_AGE for kind in NAME_KEYS}
+    return {
+        "users": CACHE_TTL_USERS + CACHE_STALE_WHILE_REVALIDATE,
+        "worlds": CACHE_TTL_WORLDS + CACHE_STALE_WHILE_REVALIDATE
+    }
+
+search_index: Optional[SearchIndex] = SearchIndex(SEARCH_INDEX_MAX_ENTRIES, _max_ages()) if SEARCH_INDEX_ENABLED else None
@@ -0,0 +1,253 @@
+"""
+Shared upstream HTTP client for VRChat API calls
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+import httpx
+from app.env import (
+    UPSTREAM_HTTP2,
+    UPSTREAM_MAX_CONNECTIONS,
+    UPSTREAM_MAX_KEEPALIVE,
+    UPSTREAM_KEEPALIVE_EXPIRY,
+    UPSTREAM_TIMEOUT,
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_POOL_TIMEOUT,
+    UPSTREAM_RATE_LIMIT,
+    UPSTREAM_RATE_BURST,
+    SERVER_WORKER_COUNT,
+    UPSTREAM_RETRY_AFTER_DEFAULT,
+    UPSTREAM_MODE,
+    UPSTREAM_RECORDING_PATH,
+    UPSTREAM_REPLAY_TIMING
+)
+from app.upstream_recording import RecordingTransport, ReplayTransport
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Priority classes for outbound calls, lower goes first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+_client: Optional[httpx.AsyncClient] = None
+
+def _http2_available() -> bool:
+    """Check whether the optional 'h2' package is installed"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def create_upstream_transport(http2: bool, limits: httpx.Limits) -> Optional[httpx.AsyncBaseTransport]:
+    """Transport for the record and replay modes; None when live, so the client builds its own"""
+    if UPSTREAM_MODE == "replay":
+        return ReplayTransport(Path(UPSTREAM_RECORDING_PATH), timing=UPSTREAM_REPLAY_TIMING)
+    if UPSTREAM_MODE == "record":
+        logger.info(f"Recording upstream exchanges to {UPSTREAM_RECORDING_PATH}")
+        return RecordingTransport(httpx.AsyncHTTPTransport(http2=http2, limits=limits), Path(UPSTREAM_RECORDING_PATH))
+    if UPSTREAM_MODE != "live":
+        logger.warning(f"Unknown UPSTREAM_MODE '{UPSTREAM_MODE}', calling VRChat live")
+    return None
+
+def create_upstream_client() -> httpx.AsyncClient:
+    """Build a pooled client with the configured limits and timeouts"""
+    http2 = UPSTREAM_HTTP2 and _http2_available()
+    if UPSTREAM_HTTP2 and not http2:
+        logger.warning("UPSTREAM_HTTP2 is enabled but 'h2' is not installed, falling back to HTTP/1.1")
+
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY
+    )
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=limits,
+        transport=create_upstream_transport(http2, limits),
+        timeout=httpx.Timeout(
+            UPSTREAM_TIMEOUT,
+            connect=UPSTREAM_CONNECT_TIMEOUT,
+            pool=UPSTREAM_POOL_TIMEOUT
+        ),
+        # The client is shared by every request, so never let upstream
+        # Set-Cookie headers leak into a common cookie jar.
+        cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+    )
+
+def get_upstream_client() -> httpx.AsyncClient:
+    """Return the application-wide upstream client, creating it if needed"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_upstream_client()
+    return _client
+
+async def start_upstream_client():
+    """Open the shared client (called from the application lifespan)"""
+    get_upstream_client()
+
+async def warm_upstream_client(url: str, headers: dict):
+    """Open a pooled connection ahead of the first request, so no caller waits for DNS, TCP and TLS"""
+    try:
+        await get_upstream_client().head(url, headers=headers, timeout=UPSTREAM_CONNECT_TIMEOUT)
+    except httpx.HTTPError as e:
+        logger.warning(f"Could not warm up the upstream connection pool: {e}")
+
+async def close_upstream_client():
+    """Close the shared client and release its pooled connections"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def pool_stats() -> Dict[str, int]:
+    """Connections of the shared client's pool by state, and calls waiting for one (empty when unknown)"""
+    transport = getattr(_client, "_transport", None)
+    # Look through the recording transport; a replay has no pool
+    pool = getattr(getattr(transport, "_transport", transport), "_pool", None)
+    if pool is None:
+        return {}
+    connections = pool.connections
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        "active": len(connections) - idle,
+        "idle": idle,
+        "waiting": sum(1 for request in getattr(pool, "_requests", ()) if request.is_queued())
+    }
+
+class SingleFlight:
+    """
+    Deduplicate concurrent identical calls: callers sharing a key while a call
+    is in flight await the same task instead of starting their own
+    """
+    def __init__(self):
+        self._inflight: Dict[str, "asyncio.Task"] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # Shield the shared task so one disconnecting client does not cancel it for everyone else
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: "asyncio.Task"):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter went away
+            task.exception()
+
+upstream_flights = SingleFlight()
+
+class OutboundLimiter:
+    """
+    Token bucket shared by every upstream call. When no token is available callers
+    queue by priority class (then arrival order) instead of failing, and a 429 from
+    VRChat pauses the whole bucket for its Retry-After.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, priority: int, deadline: float):
+        """Wait for a token; raises asyncio.TimeoutError if the deadline (monotonic) passes first"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if self.blocked_until > deadline:
+            # Upstream will not take calls again before this caller gives up
+            raise asyncio.TimeoutError()
+        if not self._waiters and now >= self.blocked_until:
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._schedule()
+        # A waiter timing out cancels its future, which the dispatcher then skips
+        await asyncio.wait_for(future, timeout=max(0.0, deadline - now))
+
+    def block(self, seconds: float):
+        """Stop handing out tokens for the given time (upstream asked us to back off)"""
+        if not self.enabled:
+            return
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+        self._schedule()
+
+    def _schedule(self):
+        if self._wakeup is not None or not self._waiters:
+            return
+        now = time.monotonic()
+        if now < self.blocked_until:
+            delay = self.blocked_until - now
+        else:
+            self._refill(now)
+            delay = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _dispatch(self):
+        self._wakeup = None
+        now = time.monotonic()
+        if now >= self.blocked_until:
+            self._refill(now)
+            while self._waiters and self.tokens >= 1:
+                _, _, future = heapq.heappop(self._waiters)
+                if future.done():
+                    continue
+                self.tokens -= 1
+                future.set_result(None)
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        self._schedule()
+
+def parse_retry_after(value: Optional[str], default: float = UPSTREAM_RETRY_AFTER_DEFAULT) -> float:
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+# Each worker gets its share of the outbound budget, so VRChat sees the configured total rate
+outbound_limiter = OutboundLimiter(rate=UPSTREAM_RATE_LIMIT / SERVER_WORKER_COUNT, burst=UPSTREAM_RATE_BURST // SERVER_WORKER_COUNT)
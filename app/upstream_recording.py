@@ -0,0 +1,130 @@
+"""
+Record and replay of VRChat API exchanges, as transports under the shared upstream client.
+UPSTREAM_MODE=record saves every upstream GET to a SQLite file; UPSTREAM_MODE=replay serves
+them back from that file without touching the network, for load tests and offline operation.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Response headers kept in recordings; dates, cookies and tracing headers are dropped
+RECORDED_HEADERS = ("content-type", "content-encoding", "etag", "last-modified", "retry-after", "cache-control")
+
+def exchange_key(request: httpx.Request) -> str:
+    """Method and URL with sorted query parameters, so equivalent requests match"""
+    url = request.url.copy_with(params=sorted(request.url.params.multi_items()))
+    return f"{request.method} {url}"
+
+def _connect(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS exchanges ("
+        "id INTEGER PRIMARY KEY, key TEXT NOT NULL, status INTEGER NOT NULL, headers TEXT NOT NULL, "
+        "body BLOB NOT NULL, recorded_at REAL NOT NULL, duration REAL NOT NULL)"
+    )
+    return conn
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    Passes requests to the real transport and stores each GET exchange: the response
+    status, a few headers, the zlib-compressed raw body, and how long VRChat took to answer.
+    Request headers (cookies, auth) are never stored. 304s carry no body and are not recorded.
+    """
+    def __init__(self, transport: httpx.AsyncBaseTransport, path: Path):
+        self._transport = transport
+        self._conn = _connect(path)
+        self._lock = threading.Lock()
+        self._pending: Set["asyncio.Task"] = set()
+        self.recorded = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.monotonic()
+        response = await self._transport.handle_async_request(request)
+        if request.method != "GET" or response.status_code == 304:
+            return response
+        try:
+            body = b"".join([chunk async for chunk in response.stream])
+        finally:
+            await response.aclose()
+        duration = time.monotonic() - started
+        headers = [(name, value) for name, value in response.headers.multi_items() if name in RECORDED_HEADERS]
+        task = asyncio.ensure_future(asyncio.to_thread(
+            self._insert, exchange_key(request), response.status_code, headers, body, duration
+        ))
+        self._pending.add(task)
+        task.add_done_callback(self._written)
+        return httpx.Response(
+            response.status_code, headers=response.headers, stream=httpx.ByteStream(body), extensions=response.extensions
+        )
+
+    def _insert(self, key: str, status: int, headers: List[Tuple[str, str]], body: bytes, duration: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO exchanges (key, status, headers, body, recorded_at, duration) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, status, json.dumps(headers), zlib.compress(body), time.time(), duration)
+            )
+            self.recorded += 1
+
+    def _written(self, task: "asyncio.Task"):
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Could not record upstream exchange: {task.exception()}")
+
+    async def aclose(self):
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        await self._transport.aclose()
+        await asyncio.to_thread(self._conn.close)
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Answers from a recording instead of the network. Exchanges recorded several times for the
+    same request are served in their recorded order, round-robin, each after its original
+    duration multiplied by 'timing' (1 = original latency, 0 = immediately).
+    Requests missing from the recording get a 504, as if VRChat were unreachable.
+    """
+    def __init__(self, path: Path, timing: float = 1.0):
+        if not path.exists():
+            raise FileNotFoundError(f"Upstream recording not found: {path}")
+        self.timing = timing
+        self.misses = 0
+        self._exchanges: Dict[str, List[Tuple[int, List[Tuple[str, str]], bytes, float]]] = defaultdict(list)
+        self._positions: Dict[str, int] = defaultdict(int)
+        conn = _connect(path)
+        try:
+            for key, status, headers, body, duration in conn.execute(
+                "SELECT key, status, headers, body, duration FROM exchanges ORDER BY id"
+            ):
+                self._exchanges[key].append((status, json.loads(headers), zlib.decompress(body), duration))
+        finally:
+            conn.close()
+        logger.info(f"Replaying {sum(map(len, self._exchanges.values()))} upstream exchanges from {path}")
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = exchange_key(request)
+        recorded = self._exchanges.get(key)
+        if not recorded:
+            self.misses += 1
+            logger.debug(f"Not in upstream recording: {key}")
+            return httpx.Response(
+                504, headers={"content-type": "application/json"},
+                stream=httpx.ByteStream(b'{"error":{"message":"Not in upstream recording","status_code":504}}')
+            )
+        position = self._positions[key]
+        self._positions[key] = (position + 1) % len(recorded)
+        status, headers, body, duration = recorded[position]
+        if self.timing > 0:
+            await asyncio.sleep(duration * self.timing)
+        return httpx.Response(status, headers=headers, stream=httpx.ByteStream(body))
@@ -2,10 +2,31 @@
 Common utilities for security, validation, and error handling
 """
 import re
+import hmac
+import time
+import asyncio
 import logging
-from typing import Optional
-from fastapi import HTTPException
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from fastapi import Header, HTTPException, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
 import httpx
+import orjson
+from app.env import ADMIN_TOKEN, API_BASE, METRICS_TOKEN, CACHE_ENABLED, COMPRESSION_MIN_SIZE, UPSTREAM_COALESCE, UPSTREAM_QUEUE_TIMEOUT, BATCH_MAX_IDS, BATCH_CONCURRENCY, PAGINATION_PAGE_SIZE
+from app.cache import CACHE_POLICIES, CachePolicy, CacheEntry, ResponseCache, encoded_etag, negative_cache, response_cache, upstream_validators
+from app.disk_cache import disk_cache
+from app.compression import accepted_encoding
+from app.search_index import search_index
+from app.profiling import span
+from app.metrics import is_metrics_scraper, upstream_endpoint, upstream_queue_timeouts, upstream_request_duration, upstream_requests, upstream_requests_in_flight
+from app.upstream import (
+    PRIORITY_INTERACTIVE,
+    PRIORITY_BULK,
+    get_upstream_client,
+    outbound_limiter,
+    parse_retry_after,
+    upstream_flights
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,7 +36,11 @@ logger = logging.getLogger(__name__)
 VRCHAT_USER_ID_PATTERN = re.compile(r'^usr_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
 VRCHAT_GROUP_ID_PATTERN = re.compile(r'^grp_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
 VRCHAT_WORLD_ID_PATTERN = re.compile(r'^wrld_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+VRCHAT_AVATAR_ID_PATTERN = re.compile(r'^avtr_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
 VRCHAT_INSTANCE_ID_PATTERN = re.compile(r'^[0-9a-zA-Z~:_-]+$')
+# Field projection: comma separated keys, nested with dots (e.g. "displayName,badges.badgeName")
+FIELD_PATH_PATTERN = re.compile(r'^[A-Za-z0-9_]+(\.[A-Za-z0-9_]+)*$')
+MAX_FIELDS = 50
 
 def validate_vrchat_user_id(user_id: str) -> str:
     """Validate VRChat user ID format"""
@@ -38,6 +63,13 @@ def validate_vrchat_world_id(world_id: str) -> str:
         raise HTTPException(status_code=400, detail="Invalid world ID format")
     return world_id
 
+def validate_vrchat_avatar_id(avatar_id: str) -> str:
+    """Validate VRChat avatar ID format"""
+    if not avatar_id or not VRCHAT_AVATAR_ID_PATTERN.match(avatar_id):
+        logger.warning(f"Invalid avatar ID format attempted: {avatar_id[:10]}...")
+        raise HTTPException(status_code=400, detail="Invalid avatar ID format")
+    return avatar_id
+
 def validate_vrchat_instance_id(instance_id: str) -> str:
     """Validate VRChat instance ID format"""
     if not instance_id or not VRCHAT_INSTANCE_ID_PATTERN.match(instance_id) or len(instance_id) > 100:
@@ -62,6 +94,37 @@ def validate_pagination_params(offset: Optional[int] = None, n: Optional[int] =
     
     return offset, n
 
+def parse_fields(fields: Optional[str]) -> Optional[dict]:
+    """Parse a ?fields= value into a tree of nested keys, or None to return everything"""
+    if fields is None or not fields.strip():
+        return None
+    paths = [path.strip() for path in fields.split(",") if path.strip()]
+    if len(paths) > MAX_FIELDS or not all(FIELD_PATH_PATTERN.match(path) for path in paths):
+        raise HTTPException(status_code=400, detail="Invalid fields parameter")
+    tree: dict = {}
+    for path in paths:
+        node = tree
+        keys = path.split(".")
+        for i, key in enumerate(keys):
+            if i == len(keys) - 1:
+                node[key] = None  # the whole value
+            elif node.get(key, {}) is not None:
+                node = node.setdefault(key, {})
+            else:
+                break  # a parent path already selects the whole value
+    return tree
+
+def project_fields(data: Any, tree: dict) -> Any:
+    """Keep only the selected keys; lists are projected item by item"""
+    if isinstance(data, list):
+        return [project_fields(item, tree) for item in data]
+    if not isinstance(data, dict):
+        return data
+    return {
+        key: data[key] if subtree is None else project_fields(data[key], subtree)
+        for key, subtree in tree.items() if key in data
+    }
+
 def sanitize_error_message(error: str, status_code: int) -> str:
     """Sanitize error messages to prevent information disclosure"""
     # Map common error patterns to generic messages
@@ -81,12 +144,56 @@ def sanitize_error_message(error: str, status_code: int) -> str:
         # For client errors, provide generic message
         return "Request could not be processed"
 
-async def make_vrchat_request(url: str, headers: dict, cookies: dict) -> httpx.Response:
+async def _upstream_get(client: httpx.AsyncClient, url: str, headers: dict, params: Optional[dict]) -> httpx.Response:
+    """One call to VRChat, counted and timed per endpoint"""
+    endpoint = upstream_endpoint(url[len(API_BASE):] if url.startswith(API_BASE) else httpx.URL(url).path)
+    status = "error"
+    upstream_requests_in_flight.inc()
+    started = time.perf_counter()
+    try:
+        response = await client.get(url, headers=headers, params=params)
+        status = str(response.status_code)
+        return response
+    except httpx.TimeoutException:
+        status = "timeout"
+        raise
+    finally:
+        upstream_requests_in_flight.dec()
+        upstream_request_duration.observe(time.perf_counter() - started, endpoint)
+        upstream_requests.inc(endpoint, status)
+
+async def make_vrchat_request(url: str, headers: dict, cookies: Optional[dict] = None, params: Optional[dict] = None, priority: int = PRIORITY_INTERACTIVE) -> httpx.Response:
     """Make a secure request to VRChat API with proper error handling"""
+    if cookies:
+        headers = {**headers, "Cookie": "; ".join(f"{name}={value}" for name, value in cookies.items())}
+
+    async def send() -> httpx.Response:
+        client = get_upstream_client()
+        deadline = time.monotonic() + UPSTREAM_QUEUE_TIMEOUT
+        while True:
+            try:
+                await outbound_limiter.acquire(priority, deadline)
+            except asyncio.TimeoutError:
+                upstream_queue_timeouts.inc()
+                logger.warning(f"VRChat API call queued too long: {url}")
+                raise HTTPException(status_code=503, detail="VRChat API busy, please try again later")
+            response = await _upstream_get(client, url, headers, params)
+            if response.status_code != 429 or not outbound_limiter.enabled:
+                return response
+            # Back off every caller, then retry this one if it can still make its deadline
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            outbound_limiter.block(retry_after)
+            logger.warning(f"VRChat API rate limited us, pausing upstream calls for {retry_after:.1f}s")
+            if time.monotonic() + retry_after >= deadline:
+                return response
+
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(url, headers=headers, cookies=cookies)
-            return response
+        with span("upstream"):
+            if not UPSTREAM_COALESCE:
+                return await send()
+            # Identical concurrent GETs share a single upstream call
+            key = f"{response_cache.make_key(url, params)}|{sorted(headers.items())}"
+            return await upstream_flights.do(key, send)
     except httpx.TimeoutException:
         logger.warning(f"VRChat API timeout for URL: {url}")
         raise HTTPException(status_code=504, detail="VRChat API timeout")
@@ -94,16 +201,274 @@ async def make_vrchat_request(url: str, headers: dict, cookies: dict) -> httpx.R
         logger.error(f"VRChat API request error: {str(e)}")
         raise HTTPException(status_code=502, detail="VRChat API unavailable")
 
-def handle_vrchat_response(response: httpx.Response, operation: str) -> dict:
-    """Handle VRChat API responses with proper error sanitization"""
+class ORJSONResponse(JSONResponse):
+    """JSON response encoded with orjson, the application's default response class"""
+    def render(self, content: Any) -> bytes:
+        with span("serialize"):
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+def check_vrchat_response(response: httpx.Response, operation: str):
+    """Raise a sanitized HTTPException unless VRChat answered 200"""
     if response.status_code == 200:
-        try:
-            return response.json()
-        except Exception:
-            logger.error(f"Invalid JSON response from VRChat API for {operation}")
-            raise HTTPException(status_code=502, detail="Invalid response from VRChat API")
-    
+        return
     # Sanitize error message
     sanitized_message = sanitize_error_message(response.text, response.status_code)
     logger.warning(f"VRChat API error for {operation}: {response.status_code} - {response.text[:100]}...")
-    raise HTTPException(status_code=response.status_code, detail=sanitized_message)
\ No newline at end of file
+    raise HTTPException(status_code=response.status_code, detail=sanitized_message)
+
+def check_vrchat_json(body: bytes, operation: str):
+    """Raise a 502 unless a VRChat API body is JSON. The parsed object is not kept."""
+    try:
+        with span("serialize"):
+            orjson.loads(body)
+    except orjson.JSONDecodeError:
+        logger.error(f"Invalid JSON response from VRChat API for {operation}")
+        raise HTTPException(status_code=502, detail="Invalid response from VRChat API")
+
+def cached_json(entry: CacheEntry, operation: str) -> Any:
+    """The parsed body of a cache entry, raising a 502 if it somehow is not JSON"""
+    try:
+        with span("serialize"):
+            return entry.data
+    except orjson.JSONDecodeError:
+        logger.error(f"Invalid JSON in cached response for {operation}")
+        raise HTTPException(status_code=502, detail="Invalid response from VRChat API")
+
+def handle_vrchat_response(response: httpx.Response, operation: str) -> dict:
+    """Handle VRChat API responses with proper error sanitization"""
+    check_vrchat_response(response, operation)
+    try:
+        with span("serialize"):
+            return response.json()
+    except Exception:
+        logger.error(f"Invalid JSON response from VRChat API for {operation}")
+        raise HTTPException(status_code=502, detail="Invalid response from VRChat API")
+
+# Upstream answers remembered by the negative cache
+NEGATIVE_STATUS_CODES = (403, 404)
+
+# Background revalidations in flight, by cache key (also keeps their tasks referenced)
+_revalidations: Dict[str, "asyncio.Task"] = {}
+
+async def _fetch_and_cache(key: str, url: str, headers: dict, cookies: dict, operation: str, params: Optional[dict], cache_policy: CachePolicy, priority: int, entry: Optional[CacheEntry] = None) -> CacheEntry:
+    """Fetch and store a resource. A known entry is revalidated conditionally."""
+    if entry is not None and entry.validators:
+        headers = {**headers, **entry.validators}
+    upstream = await make_vrchat_request(url, headers, cookies, params, priority)
+    if upstream.status_code == 304 and entry is not None:
+        # Unchanged upstream: extend the entry we have instead of downloading it again
+        if disk_cache is not None:
+            disk_cache.touch(key, cache_policy.lifetime)
+        return response_cache.refresh(key, entry, cache_policy)
+    if upstream.status_code in NEGATIVE_STATUS_CODES:
+        # Deleted or hidden: forget any copy we had and remember the miss for a while
+        response_cache.discard(key)
+        if disk_cache is not None:
+            disk_cache.discard(key)
+        if negative_cache is not None:
+            negative_cache.add(key, upstream.status_code)
+    check_vrchat_response(upstream, operation)
+    # Only JSON is cached: a 200 that is not (a proxy's HTML error page...) must not be served as one
+    check_vrchat_json(upstream.content, operation)
+    if disk_cache is not None:
+        disk_cache.set(key, cache_policy.name, upstream.content, cache_policy.lifetime)
+    return response_cache.set(key, upstream.content, cache_policy, validators=upstream_validators(upstream.headers))
+
+async def _restore_from_disk(key: str, cache_policy: CachePolicy) -> Optional[CacheEntry]:
+    """Promote an entry from the disk tier into memory, keeping its original fetch time"""
+    stored = await disk_cache.get(key)
+    if stored is None:
+        return None
+    body, stored_at = stored
+    try:
+        orjson.loads(body)
+    except orjson.JSONDecodeError:
+        # Stored before bodies were checked: drop it and fetch again
+        disk_cache.discard(key)
+        return None
+    fetched_at = time.monotonic() - max(0.0, time.time() - stored_at)
+    return response_cache.set(key, body, cache_policy, now=fetched_at)
+
+def _revalidate_in_background(key: str, *args):
+    """Refresh a stale cache entry without making the current caller wait"""
+    if key in _revalidations:
+        return
+
+    async def revalidate():
+        try:
+            await _fetch_and_cache(key, *args)
+        except HTTPException as e:
+            logger.info(f"Background refresh failed ({e.status_code}), keeping stale cache entry")
+        except Exception as e:
+            logger.error(f"Background refresh of {key} failed: {e}, keeping stale cache entry")
+        finally:
+            _revalidations.pop(key, None)
+
+    _revalidations[key] = asyncio.ensure_future(revalidate())
+
+async def _fetch_cached(url: str, headers: dict, cookies: dict, operation: str, params: Optional[dict], cache_policy: CachePolicy, priority: int) -> Tuple[CacheEntry, str]:
+    """
+    Look a resource up in the response cache (memory, then disk) and fetch it on a miss.
+    Depending on the policy, expired entries are served while they are refreshed in the background
+    (stale-while-revalidate) or in place of an upstream failure (stale-if-error),
+    and expired entries are revalidated with VRChat conditionally.
+    Returns the entry and its X-Cache status.
+    """
+    key = response_cache.make_key(url, params)
+    if negative_cache is not None:
+        status_code = negative_cache.get(key)
+        if status_code is not None:
+            raise HTTPException(status_code=status_code, detail=sanitize_error_message("", status_code), headers={"X-Cache": "NEGATIVE"})
+    entry, status = response_cache.get(key)
+    if entry is None and disk_cache is not None:
+        entry = await _restore_from_disk(key, cache_policy)
+        if entry is not None:
+            status = ResponseCache.classify(entry)
+    if status == "STALE":
+        _revalidate_in_background(key, url, headers, cookies, operation, params, cache_policy, priority, entry)
+    if status != "MISS":
+        return entry, status
+
+    try:
+        return await _fetch_and_cache(key, url, headers, cookies, operation, params, cache_policy, priority, entry), status
+    except HTTPException as e:
+        # Timeouts, unreachable or failing upstream: fall back on the last good copy
+        if entry is None or e.status_code < 500 or time.monotonic() >= entry.error_until:
+            raise
+        logger.warning(f"Serving stale cache entry for {operation} after upstream error {e.status_code}")
+        return entry, "STALE-IF-ERROR"
+
+def _cache_policy(policy: Optional[str]) -> Optional[CachePolicy]:
+    cache_policy = CACHE_POLICIES.get(policy) if CACHE_ENABLED and policy else None
+    return cache_policy if cache_policy is not None and cache_policy.ttl > 0 else None
+
+def _index_fetched(index: Optional[str], entry: CacheEntry, status: str):
+    """Feed users/worlds freshly fetched from VRChat to the local search index"""
+    if index is not None and status == "MISS" and search_index is not None:
+        search_index.add(index, entry.data)
+
+async def fetch_vrchat_json(url: str, headers: dict, cookies: dict, operation: str, params: Optional[dict] = None, policy: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE, index: Optional[str] = None) -> Any:
+    """Fetch and parse a VRChat API resource, served from the response cache when the route family allows it"""
+    cache_policy = _cache_policy(policy)
+    if cache_policy is None:
+        upstream = await make_vrchat_request(url, headers, cookies, params, priority)
+        return handle_vrchat_response(upstream, operation)
+    entry, status = await _fetch_cached(url, headers, cookies, operation, params, cache_policy, priority)
+    _index_fetched(index, entry, status)
+    return cached_json(entry, operation)
+
+async def proxy_vrchat_json(url: str, headers: dict, cookies: dict, operation: str, params: Optional[dict] = None, policy: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE, fields: Optional[str] = None, index: Optional[str] = None) -> Response:
+    """
+    Forward a VRChat API resource to the client as the exact bytes VRChat sent, without parsing
+    and re-encoding it. Only the status is checked. Cached responses carry X-Cache and a precomputed ETag.
+    With 'fields', the response is projected down to the requested keys instead; every projection
+    of a cached resource is served from the same cached object.
+    With 'index' ("users" or "worlds"), fresh responses also feed the local search index.
+    """
+    tree = parse_fields(fields)
+    cache_policy = _cache_policy(policy)
+    if cache_policy is None:
+        upstream = await make_vrchat_request(url, headers, cookies, params, priority)
+        if tree is not None:
+            return ORJSONResponse(project_fields(handle_vrchat_response(upstream, operation), tree))
+        check_vrchat_response(upstream, operation)
+        return Response(content=upstream.content, media_type="application/json")
+    entry, status = await _fetch_cached(url, headers, cookies, operation, params, cache_policy, priority)
+    _index_fetched(index, entry, status)
+    if tree is not None:
+        # The projected body gets its own ETag from ETagMiddleware
+        data = cached_json(entry, operation)
+        with span("serialize"):
+            return ORJSONResponse(project_fields(data, tree), headers={"X-Cache": status})
+    response_headers = {"X-Cache": status, "ETag": entry.etag}
+    encoding = accepted_encoding.get()
+    if encoding is not None and len(entry.body) >= COMPRESSION_MIN_SIZE:
+        # Hot entries are compressed once and then served precompressed
+        with span("serialize"):
+            body = await response_cache.compressed(response_cache.make_key(url, params), entry, encoding)
+        return Response(content=body, media_type="application/json", headers={
+            **response_headers, "ETag": encoded_etag(entry.etag, encoding), "Content-Encoding": encoding, "Vary": "Accept-Encoding"
+        })
+    return Response(content=entry.body, media_type="application/json", headers=response_headers)
+
+async def stream_vrchat_pages(url: str, headers: dict, cookies: dict, operation: str, params: Optional[dict] = None, items_key: Optional[str] = None, page_size: int = PAGINATION_PAGE_SIZE) -> AsyncIterator[bytes]:
+    """
+    Page through a VRChat list endpoint and return its items as NDJSON lines.
+    The first page is fetched up front so upstream errors still map to an HTTP status;
+    afterwards the next page is prefetched while the current one is streamed,
+    so at most two pages are held in memory.
+    """
+    async def fetch_page(offset: int) -> list:
+        page_params = {**(params or {}), "n": str(page_size), "offset": str(offset)}
+        # Exports are bulk traffic: interactive lookups go ahead of them upstream
+        response = await make_vrchat_request(url, headers, cookies, page_params, PRIORITY_BULK)
+        data = handle_vrchat_response(response, operation)
+        if items_key and isinstance(data, dict):
+            data = data.get(items_key)
+        return data if isinstance(data, list) else []
+
+    first_page = await fetch_page(0)
+
+    async def lines() -> AsyncIterator[bytes]:
+        items, offset, next_page = first_page, 0, None
+        try:
+            while items:
+                offset += len(items)
+                if len(items) >= page_size:
+                    next_page = asyncio.ensure_future(fetch_page(offset))
+                for item in items:
+                    yield orjson.dumps(item) + b"\n"
+                if next_page is None:
+                    break
+                items = await next_page
+                next_page = None
+        except HTTPException as e:
+            # Headers are already sent, so report the failure in-band as a last line
+            yield orjson.dumps({"error": e.detail, "code": e.status_code}) + b"\n"
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    return lines()
+
+class BatchLookupRequest(BaseModel):
+    ids: List[str] = Field(min_length=1, max_length=BATCH_MAX_IDS)
+    fields: Optional[str] = None
+
+async def run_batch_lookup(ids: List[str], validator: Callable[[str], str], fetch: Callable[[str], Awaitable[Any]], fields: Optional[str] = None) -> dict:
+    """Validate and fetch several IDs with bounded concurrency, collecting per-ID results and errors"""
+    tree = parse_fields(fields)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    results = {}
+    errors = {}
+
+    async def lookup(entity_id: str):
+        try:
+            validator(entity_id)
+            async with semaphore:
+                result = await fetch(entity_id)
+            results[entity_id] = result if tree is None else project_fields(result, tree)
+        except HTTPException as e:
+            errors[entity_id] = {"error": e.detail, "code": e.status_code}
+        except Exception as e:
+            # One broken lookup must not fail the whole batch
+            logger.error(f"Batch lookup failed for {entity_id}: {e}")
+            errors[entity_id] = {"error": "Internal server error", "code": 500}
+
+    # Duplicate IDs are looked up once
+    await asyncio.gather(*(lookup(entity_id) for entity_id in dict.fromkeys(ids)))
+    return {"results": results, "errors": errors}
+
+def require_metrics_token(authorization: Optional[str] = Header(default=None)):
+    """Dependency guarding /api/metrics with METRICS_TOKEN as a bearer token. The endpoint is disabled without one."""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=403, detail="Metrics endpoint is disabled")
+    if not is_metrics_scraper(authorization):
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+def require_admin_token(x_admin_token: Optional[str] = Header(default=None)):
+    """Dependency guarding admin endpoints with the ADMIN_TOKEN shared secret"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Authentication required")
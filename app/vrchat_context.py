@@ -1,5 +1,7 @@
 from http.client import HTTPException
+import asyncio
 import json
+import logging
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional
@@ -7,7 +9,9 @@ import os
 import httpx
 from fastapi import HTTPException
 import sys
-from app.env import IS_DISTANT, DISTANT_URL_CONTEXT, TOKEN_FILE
+from app.env import IS_DISTANT, DISTANT_URL_CONTEXT, TOKEN_FILE, CONTEXT_WATCH_INTERVAL, DISTANT_CONTEXT_TTL
+
+logger = logging.getLogger(__name__)
 
 @dataclass
 class VRChatData:
@@ -19,6 +23,7 @@ class VRChatData:
 
 class VRChatContext:
     _instance: Optional["VRChatContext"] = None
+    _mtime: Optional[float] = None
 
     def __init__(self):
         self._token: Optional[VRChatData] = None
@@ -34,9 +39,11 @@ class VRChatContext:
     def _load_from_local(cls, path: Path = Path(TOKEN_FILE)):
         if not path.exists():
             raise FileNotFoundError(f"{TOKEN_FILE} file not found: {path}")
+        mtime = path.stat().st_mtime
         with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
         cls._set_instance(data)
+        cls._mtime = mtime
 
     @classmethod
     def _load_from_remote(cls):
@@ -52,16 +59,54 @@ class VRChatContext:
         except httpx.RequestError as e:
             raise ConnectionError(f"Could not fetch remote VRChat Data: {e}")
 
+    @classmethod
+    async def refresh(cls):
+        """Reload the context without blocking the event loop"""
+        if IS_DISTANT:
+            await cls._refresh_from_remote()
+        else:
+            await cls._refresh_from_local()
+
+    @classmethod
+    async def _refresh_from_local(cls, path: Path = Path(TOKEN_FILE)):
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != cls._mtime:
+            await asyncio.to_thread(cls._load_from_local, path)
+            logger.info("VRChat context reloaded from %s", path)
+
+    @classmethod
+    async def _refresh_from_remote(cls):
+        remote_url = DISTANT_URL_CONTEXT
+        if not remote_url:
+            raise EnvironmentError("DISTANT_URL_CONTEXT is not defined in environment")
+
+        try:
+            async with httpx.AsyncClient(timeout=5.0) as client:
+                response = await client.get(remote_url)
+            response.raise_for_status()
+            cls._set_instance(response.json())
+        except httpx.RequestError as e:
+            raise ConnectionError(f"Could not fetch remote VRChat Data: {e}")
+
     @classmethod
     def _set_instance(cls, data: dict):
-        cls._instance = cls()
-        cls._instance._token = VRChatData(
+        instance = cls()
+        instance._token = VRChatData(
             display_name=data.get("displayName", ""),
             user_id=data.get("user_id", ""),
             auth_cookie=data.get("auth_cookie", ""),
             auth_header=data.get("auth", ""),
             manual_username=data.get("manual_username", "")
         )
+        # Swap in a fully built instance so readers never see a partial token
+        cls._instance = instance
+
+    @classmethod
+    def is_loaded(cls) -> bool:
+        return cls._instance is not None and cls._instance._token is not None
 
     @classmethod
     def get(cls) -> VRChatData:
@@ -69,9 +114,37 @@ class VRChatContext:
             raise RuntimeError("VRChatContext not initialized. Call VRChatContext.load() first.")
         return cls._instance._token
 
+async def refresh_context_forever():
+    """
+    Background task keeping the in-memory context up to date.
+    Local tokens are re-read when the token file's mtime changes,
+    remote tokens are re-fetched every DISTANT_CONTEXT_TTL seconds.
+    """
+    interval = DISTANT_CONTEXT_TTL if IS_DISTANT else CONTEXT_WATCH_INTERVAL
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await VRChatContext.refresh()
+        except Exception as e:
+            logger.warning(f"VRChatContext refresh failed, keeping previous context: {e}")
+
 def get_context_safely():
+    """
+    Current VRChat context. While serving, it is only read from memory: loading is left to
+    the lifespan and refresh_context_forever, and requests get a 503 until it is available.
+    Outside the event loop (building the app, scripts) it is loaded on first use.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        if not VRChatContext.is_loaded():
+            raise HTTPException(status_code=503, detail="VRChat context not loaded yet, please try again later")
+        return VRChatContext.get()
     try:
-        VRChatContext.load()
+        if not VRChatContext.is_loaded():
+            VRChatContext.load()
         return VRChatContext.get()
     except Exception as e:
         if "uvicorn" in sys.argv[0] or "main.py" in sys.argv[0]:
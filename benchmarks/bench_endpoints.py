@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the bridge's own overhead, without network access
+Starts the local VRChat stand-in (stub_upstream.py) and the real application
+(uvicorn --factory app.main:create_main_app, pointed at the stub with a throwaway token),
+then drives each endpoint with a concurrent load generator. For every endpoint the
+report gives requests per second, p50/p95/p99 latency, the bridge's peak RSS during
+the run, status codes and X-Cache values, as JSON that can be compared between commits.
+Each request carries its own X-Forwarded-For address so the per-client rate limiter
+is exercised without rejecting the benchmark.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(Path(__file__).resolve().parent))
+from stub_upstream import add_arguments as add_stub_arguments
+
+
+def entity_id(prefix: str, i: int) -> str:
+    return f"{prefix}_{uuid.UUID(int=i)}"
+
+
+# name -> (method, request builder taking the index of a pooled ID); pooled IDs set the cache hit ratio
+Scenario = Tuple[str, Callable[[int], Tuple[str, Optional[dict]]]]
+SCENARIOS: Dict[str, Scenario] = {
+    "ping": ("GET", lambda i: ("/api/ping", None)),
+    "users": ("GET", lambda i: (f"/api/users/{entity_id('usr', i)}", None)),
+    "users_fields": ("GET", lambda i: (f"/api/users/{entity_id('usr', i)}?fields=id,displayName,status", None)),
+    "users_batch": ("POST", lambda i: ("/api/users/batch", {"ids": [entity_id("usr", i + k) for k in range(20)]})),
+    "worlds": ("GET", lambda i: (f"/api/worlds/{entity_id('wrld', i)}", None)),
+    "groups": ("GET", lambda i: (f"/api/groups/{entity_id('grp', i)}", None)),
+    "avatars": ("GET", lambda i: (f"/api/avatars/{entity_id('avtr', i)}", None)),
+    "search_users": ("GET", lambda i: (f"/api/search/users/bench{i}", None)),
+    "auth_exists": ("GET", lambda i: (f"/api/auth/exists/username/bench{i}", None)),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of a process in MiB (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not come up")
+            await asyncio.sleep(0.1)
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, pid: int, requests: int, concurrency: int, id_pool: int, seed: int) -> dict:
+    method, build = SCENARIOS[name]
+    rng = random.Random(seed)
+    plan = [build(rng.randrange(id_pool)) for _ in range(requests)]
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    cache: Counter = Counter()
+    peak_rss = rss_mb(pid)
+    next_request = 0
+
+    async def worker():
+        nonlocal next_request
+        while next_request < len(plan):
+            i = next_request
+            next_request += 1
+            path, body = plan[i]
+            headers = {"X-Forwarded-For": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"}
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body, headers=headers)
+                statuses[str(response.status_code)] += 1
+                cache[response.headers.get("X-Cache", "-")] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            rss = rss_mb(pid)
+            if rss is not None:
+                peak_rss = max(peak_rss or 0, rss)
+            await asyncio.sleep(0.02)
+
+    sampler = asyncio.create_task(sample_rss())
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+
+    latencies.sort()
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "rps": round(requests / elapsed, 1),
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "mean": ms(sum(latencies) / len(latencies)),
+            "max": ms(latencies[-1])
+        },
+        "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None,
+        "status": dict(statuses),
+        "x_cache": dict(cache)
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default=",".join(SCENARIOS), help=f"comma separated, among: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--id-pool", type=int, default=200, help="distinct IDs per endpoint; smaller pools mean more cache hits")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="-", help="JSON report file ('-' for stdout)")
+    parser.add_argument("--verbose", action="store_true", help="show the bridge and stub logs")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = [name for name in endpoints if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(unknown)}")
+
+    stub_port, bridge_port = free_port(), free_port()
+    logs = None if args.verbose else subprocess.DEVNULL
+    with tempfile.TemporaryDirectory() as tmp:
+        token_file = Path(tmp) / "account.json"
+        token_file.write_text(json.dumps({
+            "displayName": "bench", "user_id": entity_id("usr", 0), "auth_cookie": "authcookie_bench", "auth": ""
+        }))
+        env = {
+            **os.environ,
+            "PYTHONPATH": str(ROOT),
+            "VRCHAT_API_BASE": f"http://127.0.0.1:{stub_port}/api/1",
+            "TOKEN_FILE": str(token_file),
+            "IS_DISTANT": "false",
+            "UPSTREAM_RATE_LIMIT": "0",
+            "CACHE_DISK_ENABLED": "false",
+            "RATE_LIMIT_BACKEND": "memory"
+        }
+        stub = subprocess.Popen([
+            sys.executable, str(Path(__file__).resolve().parent / "stub_upstream.py"), "--port", str(stub_port),
+            "--latency", str(args.latency), "--jitter", str(args.jitter),
+            "--error-rate", str(args.error_rate), "--payload-size", str(args.payload_size)
+        ], env=env, stdout=logs, stderr=logs)
+        bridge = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "--factory", "app.main:create_main_app",
+            "--host", "127.0.0.1", "--port", str(bridge_port), "--log-level", "warning", "--no-access-log"
+        ], cwd=tmp, env=env, stdout=logs, stderr=logs)
+        try:
+            await wait_ready(f"http://127.0.0.1:{stub_port}/stub/stats")
+            await wait_ready(f"http://127.0.0.1:{bridge_port}/api/ping")
+            results = {}
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{bridge_port}", limits=limits, timeout=60) as client:
+                for name in endpoints:
+                    results[name] = await run_scenario(client, name, bridge.pid, args.requests, args.concurrency, args.id_pool, args.seed)
+                    latency = results[name]["latency_ms"]
+                    print(
+                        f"{name:>14}: {results[name]['rps']:9.1f} req/s  p50 {latency['p50']:8.2f} ms  "
+                        f"p95 {latency['p95']:8.2f} ms  p99 {latency['p99']:8.2f} ms  rss {results[name]['peak_rss_mb']} MiB",
+                        file=sys.stderr, flush=True
+                    )
+                upstream_calls = (await client.get(f"http://127.0.0.1:{stub_port}/stub/stats")).json()
+        finally:
+            for process in (bridge, stub):
+                process.terminate()
+                process.wait()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "upstream": upstream_calls,
+        "endpoints": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        Path(args.output).write_text(output + "\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
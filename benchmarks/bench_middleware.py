@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the middleware stack on /api/ping
+Compares requests per second through the pure ASGI RateLimit and SecurityHeaders
+middleware against the previous BaseHTTPMiddleware versions. Requests are sent
+straight to the ASGI application, so only the framework and middleware cost is measured.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+from fastapi import FastAPI, Request
+from starlette.middleware.base import BaseHTTPMiddleware
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from app.api.system import router as system
+from app.middleware import RateLimitMiddleware, SecurityHeadersMiddleware
+from app.rate_limit import MemoryRateLimitBackend
+
+
+class LegacyRateLimitMiddleware(BaseHTTPMiddleware):
+    """The previous BaseHTTPMiddleware rate limiter, on the same backend"""
+    def __init__(self, app, calls_per_minute: int, calls_per_hour: int):
+        super().__init__(app)
+        self.limiter = RateLimitMiddleware(None, calls_per_minute, calls_per_hour, backend=MemoryRateLimitBackend())
+
+    async def dispatch(self, request: Request, call_next):
+        client_ip = request.client.host if request.client else "unknown"
+        current_time = time.time()
+        _, _, remaining_minute, remaining_hour = await self.limiter.check_and_record(client_ip, current_time)
+        response = await call_next(request)
+        response.headers["X-RateLimit-Limit-Minute"] = str(self.limiter.calls_per_minute)
+        response.headers["X-RateLimit-Remaining-Minute"] = str(remaining_minute)
+        response.headers["X-RateLimit-Limit-Hour"] = str(self.limiter.calls_per_hour)
+        response.headers["X-RateLimit-Remaining-Hour"] = str(remaining_hour)
+        return response
+
+
+class LegacySecurityHeadersMiddleware(BaseHTTPMiddleware):
+    """The previous BaseHTTPMiddleware security headers"""
+    async def dispatch(self, request: Request, call_next):
+        response = await call_next(request)
+        for name, value in SecurityHeadersMiddleware.SECURITY_HEADERS:
+            response.headers[name.decode()] = value.decode()
+        return response
+
+
+def build_app(legacy: bool) -> FastAPI:
+    app = FastAPI()
+    app.include_router(system, prefix="/api")
+    limits = {"calls_per_minute": 10**9, "calls_per_hour": 10**9}
+    if legacy:
+        app.add_middleware(LegacySecurityHeadersMiddleware)
+        app.add_middleware(LegacyRateLimitMiddleware, **limits)
+    else:
+        app.add_middleware(SecurityHeadersMiddleware)
+        app.add_middleware(RateLimitMiddleware, **limits)
+    return app
+
+
+async def call(app, scope: dict):
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(dict(scope), receive, send)
+
+
+async def measure(app, requests: int, concurrency: int) -> float:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/api/ping", "raw_path": b"/api/ping", "root_path": "",
+        "query_string": b"", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1234),
+        "server": ("bench", 80),
+    }
+    # Warm up routing and middleware stack construction
+    for _ in range(200):
+        await call(app, scope)
+
+    async def worker(count: int):
+        for _ in range(count):
+            await call(app, scope)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(requests // concurrency) for _ in range(concurrency)))
+    return (requests // concurrency * concurrency) / (time.perf_counter() - start)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    results = {}
+    for name, legacy in (("BaseHTTPMiddleware (before)", True), ("pure ASGI (after)", False)):
+        results[name] = await measure(build_app(legacy), args.requests, args.concurrency)
+        print(f"{name:>28}: {results[name]:10.0f} req/s")
+    before, after = results.values()
+    print(f"{'speedup':>28}: {after / before:10.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
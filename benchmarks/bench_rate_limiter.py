@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for RateLimitMiddleware bookkeeping
+Measures the per-request cost of checking and recording a request, and the memory
+held per tracked client, against the previous deque-based limiter. Each is run with
+clients that already made 10, 100 and 1000 requests in the last hour (the default
+hourly limit is 1000): the deque's cost and memory grow with that history, the
+sliding window counters' stay flat.
+Then checks that the shared backends enforce one common limit: several worker
+processes race for the same client and exactly the limit may get through.
+The Redis backend is included when a server answers at --redis-url, skipped otherwise.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from functools import partial
+from pathlib import Path
+from typing import Callable
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from app.middleware import RateLimitMiddleware
+from app.rate_limit import MemoryRateLimitBackend, RateLimitBackend, RedisRateLimitBackend, SharedFileRateLimitBackend
+
+
+class DequeRateLimiter:
+    """The previous implementation: a deque of timestamps per IP, scanned on every request"""
+    def __init__(self, calls_per_minute: int, calls_per_hour: int):
+        self.calls_per_minute = calls_per_minute
+        self.calls_per_hour = calls_per_hour
+        self.requests = defaultdict(deque)
+
+    def preload(self, ip: str, timestamps: list[float]):
+        """Record past requests directly: replaying them through check_and_record would be quadratic"""
+        self.requests[ip].extend(timestamps)
+
+    async def check_and_record(self, ip: str, current_time: float) -> tuple[bool, str, int, int]:
+        requests = self.requests[ip]
+        while requests and requests[0] < current_time - 3600:
+            requests.popleft()
+        minute_requests = sum(1 for req_time in requests if req_time > current_time - 60)
+        if minute_requests >= self.calls_per_minute:
+            return True, "minute", 0, 0
+        if len(requests) >= self.calls_per_hour:
+            return True, "hour", 0, 0
+        requests.append(current_time)
+        return False, "", self.calls_per_minute - minute_requests - 1, self.calls_per_hour - len(requests)
+
+
+async def populate(limiter, ips: list[str], per_ip: int, now: float) -> int:
+    """Record 'per_ip' requests per client over the last 50 minutes; returns the bytes of state allocated"""
+    timestamps = [now - 3000 + i * (3000 / per_ip) for i in range(per_ip)]
+    tracemalloc.start()
+    try:
+        for ip in ips:
+            if isinstance(limiter, DequeRateLimiter):
+                limiter.preload(ip, timestamps)
+                continue
+            for timestamp in timestamps:
+                await limiter.backend.acquire(ip, timestamp, 10**9, 10**9)
+        allocated = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    if isinstance(limiter, RateLimitMiddleware) and isinstance(limiter.backend, SharedFileRateLimitBackend):
+        # Counters live in the shared mapping, whose size is fixed by the slot count
+        allocated += limiter.backend.slots * SharedFileRateLimitBackend.SLOT.size
+    return allocated
+
+
+async def run(limiter, ips: list[str], iterations: int, now: float) -> float:
+    """Return the mean cost of one check + record, in microseconds"""
+    sample = [random.choice(ips) for _ in range(iterations)]
+    start = time.perf_counter()
+    for i, ip in enumerate(sample):
+        await limiter.check_and_record(ip, now + i * 1e-4)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def redis_available(url: str) -> bool:
+    backend = RedisRateLimitBackend(url)
+    try:
+        await asyncio.wait_for(backend.redis.pipeline(("PING",)), timeout=1)
+        return True
+    except (OSError, asyncio.TimeoutError, RuntimeError):
+        return False
+    finally:
+        await backend.close()
+
+
+def race_worker(make_backend: Callable[[], RateLimitBackend], key: str, now: float, limit: int, attempts: int, concurrency: int) -> int:
+    """One worker process: 'attempts' concurrent requests for the same client; returns how many were let through"""
+    async def race() -> int:
+        backend = make_backend()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def attempt() -> bool:
+            async with semaphore:
+                allowed, _, _ = await backend.acquire(key, now, limit, 10**9)
+                return allowed
+
+        try:
+            return sum(await asyncio.gather(*(attempt() for _ in range(attempts))))
+        finally:
+            await backend.close()
+
+    return asyncio.run(race())
+
+
+def check_shared_limit(name: str, make_backend: Callable[[], RateLimitBackend], workers: int, limit: int) -> bool:
+    """Race 'workers' processes for one client and check exactly 'limit' requests got through"""
+    key = f"race-{time.time_ns()}"
+    # Mid-window, so the sliding estimate is the plain count
+    now = time.time() // 60 * 60 + 30
+    # Fresh interpreters, as forking a process with a running event loop is not supported
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        allowed = sum(pool.starmap(race_worker, [(make_backend, key, now, limit, limit, 16)] * workers))
+    ok = allowed == limit
+    print(f"{name:>22}: {allowed}/{workers * limit} requests allowed for a limit of {limit} {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=2000, help="number of tracked client IPs")
+    parser.add_argument("--history", default="10,100,1000", help="comma-separated requests already recorded per client in the last hour")
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15", help="Redis server for the redis backend (skipped when unreachable)")
+    parser.add_argument("--workers", type=int, default=4, help="processes racing for one client in the shared limit check")
+    parser.add_argument("--limit", type=int, default=200, help="limit used by the shared limit check")
+    args = parser.parse_args()
+
+    random.seed(0)
+    ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(args.clients)]
+    now = time.time()
+    unlimited = {"calls_per_minute": 10**9, "calls_per_hour": 10**9}
+
+    redis = await redis_available(args.redis_url)
+    if not redis:
+        print(f"No Redis server at {args.redis_url}, skipping the redis backend")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{args.clients} tracked clients, {args.iterations} iterations")
+        for history in (int(value) for value in args.history.split(",")):
+            limiters = {
+                "deque (previous)": DequeRateLimiter(**unlimited),
+                "memory backend": RateLimitMiddleware(None, **unlimited, backend=MemoryRateLimitBackend(max_clients=args.clients)),
+                "shared file backend": RateLimitMiddleware(None, **unlimited, backend=SharedFileRateLimitBackend(Path(tmp) / f"counters-{history}.bin", slots=args.clients * 2)),
+            }
+            if redis:
+                limiters["redis backend"] = RateLimitMiddleware(None, **unlimited, backend=RedisRateLimitBackend(args.redis_url, prefix=f"bench-{time.time_ns()}:"))
+            print(f"{history} recorded requests per client")
+            for name, limiter in limiters.items():
+                allocated = await populate(limiter, ips, history, now)
+                cost = await run(limiter, ips, args.iterations, now)
+                # Redis keeps its counters on the server
+                memory = "on server" if name == "redis backend" else f"{allocated / args.clients:8.0f} bytes/client"
+                print(f"{name:>22}: {cost:8.2f} us/request, {memory}")
+                if isinstance(limiter, RateLimitMiddleware):
+                    await limiter.backend.close()
+
+        print(f"{args.workers} workers racing for one client")
+        backends = {"shared file backend": partial(SharedFileRateLimitBackend, Path(tmp) / "race.bin", slots=1024)}
+        if redis:
+            backends["redis backend"] = partial(RedisRateLimitBackend, args.redis_url)
+        results = [check_shared_limit(name, factory, args.workers, args.limit) for name, factory in backends.items()]
+        if not all(results):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the VRChat API, used by the endpoint benchmarks
+Serves the JSON fixtures in benchmarks/fixtures/ for users, worlds, groups and avatars
+(with the requested ID and a name derived from it), search results and auth/exists,
+after a configurable latency, with a configurable share of 5xx errors and payloads
+padded to a configurable size. Point VRCHAT_API_BASE at http://127.0.0.1:<port>/api/1.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from pathlib import Path
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+# Fixture per entity kind, and the field padded to reach the requested payload size
+FIXTURES = {"users": "user.json", "worlds": "world.json", "groups": "group.json", "avatars": "avatar.json"}
+NAME_KEYS = {"users": "displayName", "worlds": "name", "groups": "name", "avatars": "name"}
+PADDED_KEYS = {"users": "bio", "worlds": "description", "groups": "description", "avatars": "description"}
+
+
+def build_app(latency: float, jitter: float, error_rate: float, payload_size: int, seed: int = 0) -> Starlette:
+    """latency and jitter in seconds; payload_size in bytes, 0 keeps the fixtures as they are"""
+    rng = random.Random(seed)
+    fixtures = {kind: json.loads((FIXTURES_DIR / name).read_text()) for kind, name in FIXTURES.items()}
+    stats = {"requests": 0, "errors": 0}
+
+    def entity(kind: str, entity_id: str) -> dict:
+        data = dict(fixtures[kind])
+        data["id"] = entity_id
+        data[NAME_KEYS[kind]] = f"{data[NAME_KEYS[kind]]} {entity_id[-4:]}"
+        return data
+
+    def encode(data, kind: str) -> bytes:
+        body = json.dumps(data, separators=(",", ":")).encode()
+        key = PADDED_KEYS.get(kind)
+        # Only entities are padded: lists and other payloads (auth/exists...) keep their size
+        if payload_size and len(body) < payload_size and isinstance(data, dict) and key in data:
+            data[key] += "x" * (payload_size - len(body))
+            body = json.dumps(data, separators=(",", ":")).encode()
+        return body
+
+    async def respond(kind: str, data) -> Response:
+        stats["requests"] += 1
+        delay = latency + rng.uniform(-jitter, jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if error_rate and rng.random() < error_rate:
+            stats["errors"] += 1
+            return Response(b'{"error":{"message":"stub failure","status_code":503}}', status_code=503, media_type="application/json")
+        return Response(encode(data, kind), media_type="application/json")
+
+    async def get_entity(request: Request) -> Response:
+        kind = request.path_params["kind"]
+        if kind not in FIXTURES:
+            return Response(b'{"error":{"message":"Not found","status_code":404}}', status_code=404, media_type="application/json")
+        return await respond(kind, entity(kind, request.path_params["entity_id"]))
+
+    async def search(request: Request) -> Response:
+        kind = request.url.path.split("/")[3]
+        text = request.query_params.get("search", "")
+        n = min(int(request.query_params.get("n", "12")), 100)
+        prefix = {"users": "usr", "worlds": "wrld"}[kind]
+        results = []
+        for i in range(n):
+            data = entity(kind, f"{prefix}_00000000-0000-0000-0000-{i:012x}")
+            data[NAME_KEYS[kind]] = f"{text} {i}"
+            results.append(data)
+        return await respond(kind, results)
+
+    async def auth_exists(request: Request) -> Response:
+        return await respond("users", {"userExists": False})
+
+    async def stub_stats(request: Request) -> Response:
+        return Response(json.dumps(stats), media_type="application/json")
+
+    return Starlette(routes=[
+        Route("/api/1/users", search),
+        Route("/api/1/worlds", search),
+        Route("/api/1/auth/exists", auth_exists),
+        Route("/api/1/{kind:str}/{entity_id:str}", get_entity),
+        Route("/stub/stats", stub_stats),
+    ])
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=50, help="upstream latency in milliseconds")
+    parser.add_argument("--jitter", type=float, default=10, help="latency jitter (+/-) in milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503 (0-1)")
+    parser.add_argument("--payload-size", type=int, default=0, help="pad entity bodies to this many bytes (0 keeps the fixtures)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9000)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    app = build_app(args.latency / 1000, args.jitter / 1000, args.error_rate, args.payload_size)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
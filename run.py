@@ -15,16 +15,22 @@ project_root = os.path.abspath(os.path.dirname(__file__))
 os.environ["PYTHONPATH"] = project_root + os.pathsep + os.environ.get("PYTHONPATH", "")
 port = os.environ.get("PORT", "8080")
 
+# Production mode: several workers, no reloader, uvloop/httptools and graceful drain on restart
+production = "--production" in sys.argv or os.environ.get("SERVER_MODE", "").lower() == "production"
+workers = int(os.environ.get("SERVER_WORKERS", "0")) or os.cpu_count() or 1
+graceful_timeout = os.environ.get("SERVER_GRACEFUL_TIMEOUT", "30")
+
 def create_venv():
     print("Creating virtual environment...", flush=True)
     venv.create(VENV_DIR, with_pip=True)
 
-def run_in_venv(cmd, env=None):
+def venv_python():
     if os.name == "nt":
-        python_bin = os.path.join(VENV_DIR, "Scripts", "python.exe")
-    else:
-        python_bin = os.path.join(VENV_DIR, "bin", "python")
-    full_cmd = [python_bin] + cmd
+        return os.path.join(VENV_DIR, "Scripts", "python.exe")
+    return os.path.join(VENV_DIR, "bin", "python")
+
+def run_in_venv(cmd, env=None):
+    full_cmd = [venv_python()] + cmd
     result = subprocess.run(full_cmd, env=env)
     if result.returncode != 0:
         print(f"Command {cmd} failed.", flush=True)
@@ -58,6 +64,36 @@ def is_token_valid():
         print("Error reading token file:", e, flush=True)
         return False
 
+def server_command():
+    cmd = [venv_python(), "-m", "uvicorn", "app.main:app", "--host", "0.0.0.0", "--port", port]
+    if not production:
+        return cmd + ["--reload"]
+    return cmd + [
+        "--workers", str(workers),
+        "--loop", "asyncio" if os.name == "nt" else "uvloop",  # uvloop does not support Windows
+        "--http", "httptools",
+        "--timeout-graceful-shutdown", graceful_timeout
+    ]
+
+def start_server(env):
+    if production:
+        # Workers split the outbound VRChat budget between them and need shared client rate limits
+        env["SERVER_WORKER_COUNT"] = str(workers)
+        if workers > 1 and "RATE_LIMIT_BACKEND" not in env:
+            print("Sharing client rate limits between workers (RATE_LIMIT_BACKEND=file)", flush=True)
+            env["RATE_LIMIT_BACKEND"] = "file"
+        elif workers > 1 and env["RATE_LIMIT_BACKEND"].lower() == "memory":
+            print(f"[WARN] RATE_LIMIT_BACKEND=memory: each of the {workers} workers enforces its own client limits", flush=True)
+        # Pre-fork warm-up: check the configuration and set up shared files once, before any worker starts
+        print("Preparing production workers...", flush=True)
+        run_in_venv(["app/main.py", "--prepare"], env=env)
+        print(f"Starting {workers} worker(s) on port {port}...", flush=True)
+        if os.name != "nt":
+            # Replace this process so SIGTERM reaches uvicorn directly and in-flight requests are drained
+            cmd = server_command()
+            os.execve(cmd[0], cmd, env)
+    subprocess.run(server_command(), env=env)
+
 def main():
     if not os.path.exists(VENV_DIR):
         create_venv()
@@ -75,17 +111,11 @@ def main():
 
     if is_token_valid():
         print("Valid token found, launching server normally.", flush=True)
-        run_in_venv([
-            "-m", "uvicorn", "app.main:app",
-            "--host", "0.0.0.0", "--port", port, "--reload"
-        ], env=env)
+        start_server(env)
     else:
         print("No valid token found, launching auth mode (server + login)...", flush=True)
 
-        if os.name == "nt":
-            python_bin = os.path.join(VENV_DIR, "Scripts", "python.exe")
-        else:
-            python_bin = os.path.join(VENV_DIR, "bin", "python")
+        python_bin = venv_python()
 
         auth_server_cmd = [python_bin, "app/main.py", "--auth-mode"]
         print("Starting auth-mode server...", flush=True)
@@ -116,10 +146,7 @@ def main():
                 auth_server_proc.kill()
 
             print("Starting main FastAPI server...", flush=True)
-            subprocess.run([
-                python_bin, "-m", "uvicorn", "app.main:app",
-                "--host", "0.0.0.0", "--port", port, "--reload"
-            ], env=env)
+            start_server(env)
         except Exception as e:
             print(f"Unexpected error during authentication: {e}", flush=True)
             auth_server_proc.terminate()